@@ -9,9 +9,8 @@ import shutil
 import time
 import uuid
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 
-import numpy as np
-import tensorflow as tf
 # import io
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -19,6 +18,49 @@ from flask_cors import CORS
 # , jsonify, send_from_directory
 from flask import Flask, request, render_template, json
 
+from batching import MicroBatcher
+from model_registry import ModelRegistry
+from postprocess import build_results
+from prediction_cache import PredictionCache
+
+# enable notprefect mode
+notperfect_leaf = True
+model_name = "retrained_graph"
+model_file = "tf/tf_files/retrained_graph.pb"
+label_file = "tf/tf_files/retrained_labels.txt"
+input_height = 224
+input_width = 224
+input_mean = 128
+input_std = 128
+# Mull , input , Placeholder
+input_layer = "input"
+output_layer = "final_result"
+# concurrent /predict requests batched into one sess.run, 1 disables batching
+max_batch_size = 8
+max_batch_wait_ms = 5
+# repeated uploads of the same image answered from memory, 0 disables it
+prediction_cache_size = 1024
+prediction_cache_ttl = 600
+
+registry = ModelRegistry()
+registry.load(model_name,
+              model_file=model_file,
+              label_file=label_file,
+              input_layer=input_layer,
+              output_layer=output_layer,
+              input_height=input_height,
+              input_width=input_width,
+              input_mean=input_mean,
+              input_std=input_std)
+atexit.register(registry.close)
+batcher = MicroBatcher(registry.get(model_name),
+                       max_batch_size=max_batch_size,
+                       max_wait_ms=max_batch_wait_ms,
+                       postprocess=lambda results: build_results(
+                           results, registry.get(model_name).label_table))
+prediction_cache = PredictionCache(max_size=prediction_cache_size,
+                                   ttl=prediction_cache_ttl)
+
 app = Flask(__name__,
             static_url_path='',
             static_folder='static',
@@ -41,6 +83,58 @@ def clear_id():
     return True
 
 
+def persist_upload(image_data, locate_file_path):
+    if not os.path.exists(locate_file_path):
+        os.makedirs(locate_file_path, exist_ok=True)
+    # Written under a temporary name and renamed, so a /save polling for
+    # leaf.png never moves a half-written file.
+    leaf_file = "{}/leaf.png".format(locate_file_path)
+    tmp_file = "{}.{}.tmp".format(leaf_file, uuid.uuid4().hex)
+    with open(tmp_file, "wb") as f:
+        f.write(image_data)
+    os.replace(tmp_file, leaf_file)
+
+
+# Uploads are written to disk off the request path. /save waits for the
+# pending write of its client, or polls for leaf.png when another worker
+# process took the /predict.
+upload_writer = ThreadPoolExecutor(max_workers=1)
+pending_uploads = {}
+upload_wait_timeout = 5
+atexit.register(upload_writer.shutdown)
+
+
+def queue_upload(image_data, client_id):
+    locate_file_path = "tf/tf_files/uploads/user-images/{}".format(client_id)
+    future = upload_writer.submit(persist_upload, image_data,
+                                  locate_file_path)
+    pending_uploads[client_id] = future
+
+    def forget(done):
+        if pending_uploads.get(client_id) is done:
+            pending_uploads.pop(client_id, None)
+    future.add_done_callback(forget)
+    return future
+
+
+def wait_upload(client_id, timeout=upload_wait_timeout):
+    """Whether leaf.png of `client_id` is on disk, waiting up to `timeout`."""
+    future = pending_uploads.get(client_id)
+    if future is not None:
+        try:
+            future.result()
+        except Exception as e:
+            print(e)
+            return False
+    leaf_file = "tf/tf_files/uploads/user-images/{}/leaf.png".format(client_id)
+    deadline = time.time() + timeout
+    while not os.path.exists(leaf_file):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
 scheduler = BackgroundScheduler()
 scheduler.add_job(func=clear_id, trigger="interval", hours=1)
 scheduler.start()
@@ -65,28 +159,47 @@ def eng(lang):
         return render_template('index.html')
 
 
+@app.route("/models", methods=["GET"])
+def models():
+    res = {}
+    res["status"] = "success"
+    res["response"] = registry.stats()
+    return json.dumps(res)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    res = {}
+    res["status"] = "success"
+    res["response"] = {
+        "batching": batcher.stats(),
+        "prediction_cache": prediction_cache.stats()
+    }
+    return json.dumps(res)
+
+
 @app.route("/predict", methods=["POST"])
 def prepare():
-    file = request.files['file']
-    client_id = request.form.get("id")
+    return predict_upload(request.files['file'], request.form.get("id"))
+
+
+@app.route("/save", methods=["POST"])
+def save_img():
+    return save_upload(request.form.get("leaf"), request.form.get("id"))
+
+
+def predict_upload(file, client_id):
     res = {}
     if(client_id == ""):
         res["status"] = "error"
         res["response"] = "id not found!"
     else:
-        locate_file_path = "tf/tf_files/uploads/user-images/{}".format(
-            client_id)
-        if not os.path.exists(locate_file_path):
-            os.makedirs(locate_file_path)
         res["status"] = "success"
-        res["response"] = preprocessing(file, locate_file_path, client_id)
+        res["response"] = preprocessing(file, client_id)
     return json.dumps(res)
 
 
-@app.route("/save", methods=["POST"])
-def save_img():
-    leaf_path = request.form.get("leaf")
-    client_id = request.form.get("id")
+def save_upload(leaf_path, client_id):
     res = {}
     if(client_id == ""):
         res["status"] = "error"
@@ -94,148 +207,54 @@ def save_img():
     else:
         full_path_id = "tf/tf_files/uploads/user-images/{}".format(client_id)
         full_path_leaf = "tf/tf_files/uploads/dataset/{}".format(leaf_path)
-        if not os.path.exists(full_path_id):
+        if not wait_upload(client_id):
             return "error id not found!"
         if not os.path.exists(full_path_leaf):
-            os.makedirs(full_path_leaf)
+            os.makedirs(full_path_leaf, exist_ok=True)
         randomString = uuid.uuid4().hex
         randomString = randomString.lower()[0:10]
-        shutil.move("{}/leaf.png".format(full_path_id),
-                    "{}/{}.png".format(full_path_leaf, randomString))
+        try:
+            shutil.move("{}/leaf.png".format(full_path_id),
+                        "{}/{}.png".format(full_path_leaf, randomString))
+        except (IOError, OSError):
+            # A concurrent /save of the same client moved it first.
+            return "error id not found!"
         res["status"] = "success"
         res["response"] = "Saved"
     return json.dumps(res)
 
 
-def preprocessing(file, locate_file_path, client_id):
-    full_path_file_name = "{}/leaf.png".format(locate_file_path)
-    file.save(full_path_file_name)  # saving uploaded img
-    graph = load_graph(model_file)
-    t = read_tensor_from_image_file(full_path_file_name,
-                                    input_height=input_height,
-                                    input_width=input_width,
-                                    input_mean=input_mean,
-                                    input_std=input_std)
-
-    input_name = "import/" + input_layer
-    output_name = "import/" + output_layer
-    input_operation = graph.get_operation_by_name(input_name)
-    output_operation = graph.get_operation_by_name(output_name)
-
-    with tf.compat.v1.Session(graph=graph) as sess:
-        start = time.time()
-        results = sess.run(output_operation.outputs[0], {
-                           input_operation.outputs[0]: t})
-        end = time.time()
-    results = np.squeeze(results)
-    top_k = results.argsort()[-5:][::-1]
-    labels = load_labels(label_file, True)
+def preprocessing(file, client_id):
+    image_data = file.read()
+    queue_upload(image_data, client_id)  # saving uploaded img
+    cache_key = PredictionCache.key(image_data,
+                                    registry.get(model_name).version)
+    start = time.time()
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        # Report the time this lookup took, not the original inference.
+        Return = dict(cached)
+        Return["time"] = '{:.3f}'.format(time.time() - start)
+        return Return
+
+    results = batcher.predict(image_data)
+    end = time.time()
+    label_table = registry.get(model_name).label_table
 
     Return = {}
     Return["time"] = '{:.3f}'.format(end-start)
-    Return["results"] = []
-    Return["leafs"] = []
+    Return["results"] = results
     print('\nEvaluation time (1-image): {:.3f}s\n'.format(end-start))
-    template = "{} (score={:0.5f})"
-    leafPerfect = ["สมบูรณ์", "ไม่สมบูรณ์"]
-    leafName = {
-        "basil_leaf": ["กระเพรา", 0],
-        "basil_leaf_notperfect": ["กระเพรา", 1],
-        "chili_leaf": ["พริก", 0],
-        "chili_leaf_notperfect": ["พริก", 1],
-        "kaffir_lime_leaf": ["มะกรูด", 0],
-        "kaffir_lime_leaf_notperfect": ["มะกรูด", 1],
-        "lemon_basil_leaf": ["แมงลัก", 0],
-        "lemon_basil_leaf_notperfect": ["แมงลัก", 1],
-        "lemon_leaf": ["มะนาว", 0],
-        "lemon_leaf_notperfect": ["มะนาว", 1],
-        "mint_leaf": ["สะระแหน่", 0],
-        "mint_leaf_notperfect": ["สะระแหน่", 1],
-        "sweet_basil_leaf": ["โหระพา", 0],
-        "sweet_basil_leaf_notperfect": ["โหระพา", 1]
-    }
-    for i in top_k:
-        result = {}
-        result["leaf"] = '{}'.format(labels[i])
-        result["leafThai"] = leafName['{}'.format(labels[i])][0]
-        result["perfect"] = leafName['{}'.format(labels[i])][1]
-        result["percent"] = '{:0.2f}'.format(results[i]*100)
-        Return["results"].append(result)
-        print(template.format(labels[i], results[i]))
-    for i in labels:
-        result = {}
-        result["leaf"] = i
-        if notperfect_leaf is True:
-            result["leafThai"] = 'ใบ{}{}'.format(
-                leafName[i][0], leafPerfect[leafName[i][1]])
-        else:
-            result["leafThai"] = 'ใบ{}'.format(leafName[i][0])
-        Return["leafs"].append(result)
+    template = "{} (percent={}%)"
+    for result in results:
+        print(template.format(result["leaf"], result["percent"]))
+    Return["leafs"] = label_table.leafs[notperfect_leaf]
     Return["notperfect_leaf"] = notperfect_leaf
+    prediction_cache.put(cache_key, Return)
     return Return
 
 
-def load_graph(model_file):
-    graph = tf.compat.v1.Graph()
-    graph_def = tf.compat.v1.GraphDef()
-
-    with open(model_file, "rb") as f:
-        graph_def.ParseFromString(f.read())
-    with graph.as_default():
-        tf.import_graph_def(graph_def)
-
-    return graph
-
-
-def read_tensor_from_image_file(file_name, input_height=224, input_width=224, input_mean=0, input_std=255):
-    input_name = "file_reader"
-    # output_name = "normalized"
-    file_reader = tf.compat.v1.read_file(file_name, input_name)
-    if file_name.endswith(".png"):
-        image_reader = tf.image.decode_png(
-            file_reader, channels=3, name='png_reader')
-    elif file_name.endswith(".gif"):
-        image_reader = tf.squeeze(
-            tf.image.decode_gif(file_reader, name='gif_reader'))
-    elif file_name.endswith(".bmp"):
-        image_reader = tf.image.decode_bmp(file_reader, name='bmp_reader')
-    else:
-        image_reader = tf.image.decode_jpeg(
-            file_reader, channels=3, name='jpeg_reader')
-    float_caster = tf.cast(image_reader, tf.float32)
-    dims_expander = tf.expand_dims(float_caster, 0)
-    resized = tf.compat.v1.image.resize_bilinear(
-        dims_expander, [input_height, input_width])
-    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
-    sess = tf.compat.v1.Session()
-    result = sess.run(normalized)
-    return result
-
-
-def load_labels(label_file, path=False):
-    label = []
-    proto_as_ascii_lines = tf.compat.v1.gfile.GFile(label_file).readlines()
-    for l in proto_as_ascii_lines:
-        if(path):
-            label.append(l.rstrip().replace(" ", "_"))
-        else:
-            label.append(l.rstrip())
-    return label
-
-
 if __name__ == "__main__":
-    # enable notprefect mode
-    notperfect_leaf = True
-    file_name = "tf/tf_files/uploads/leaf.png"
-    model_file = "tf/tf_files/retrained_graph.pb"
-    label_file = "tf/tf_files/retrained_labels.txt"
-    input_height = 224
-    input_width = 224
-    input_mean = 128
-    input_std = 128
-    # Mull , input , Placeholder
-    input_layer = "input"
-    output_layer = "final_result"
     # Flask init
     app.debug = True
     app.run(host='0.0.0.0', port=88)
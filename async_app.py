@@ -0,0 +1,125 @@
+"""asyncio serving mode for /predict and /save.
+
+    python async_app.py --port 88 --inference_threads 4 --max_queue 16
+
+Uploads are received on the event loop, so a slow client no longer holds a
+handler thread. Inference runs on a bounded thread pool sharing the model's
+session (TF releases the GIL inside sess.run). When all threads are busy and
+--max_queue requests already wait, new requests get a 503 with the current
+queue depth instead of timing out.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import app as app_module
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class InferencePool(object):
+    """Thread pool that refuses work beyond `max_workers + max_queue`."""
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Only touched from the event loop thread, so no lock is needed.
+        self.pending = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self):
+        return max(self.pending - self.max_workers, 0)
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected
+        }
+
+
+async def predict(request):
+    pool = request.app["inference_pool"]
+    data = await request.post()
+    upload = data.get("file")
+    if upload is None:
+        raise web.HTTPBadRequest(text="file not found!")
+    try:
+        body = await pool.run(app_module.predict_upload, upload.file,
+                              data.get("id"))
+    except PoolSaturated:
+        res = {}
+        res["status"] = "error"
+        res["response"] = "server busy, try again"
+        res["queue_depth"] = pool.queue_depth
+        return web.Response(text=json.dumps(res), status=503,
+                            content_type="application/json",
+                            headers={"Retry-After": "1"})
+    return web.Response(text=body, content_type="application/json")
+
+
+async def save(request):
+    data = await request.post()
+    body = await asyncio.get_running_loop().run_in_executor(
+        None, app_module.save_upload, data.get("leaf"), data.get("id"))
+    return web.Response(text=body)
+
+
+async def metrics(request):
+    res = {}
+    res["status"] = "success"
+    res["response"] = {
+        "batching": app_module.batcher.stats(),
+        "prediction_cache": app_module.prediction_cache.stats(),
+        "inference_pool": request.app["inference_pool"].stats()
+    }
+    return web.Response(text=json.dumps(res),
+                        content_type="application/json")
+
+
+def create_app(inference_threads=4, max_queue=16,
+               client_max_size=16 * 1024 ** 2):
+    aio_app = web.Application(client_max_size=client_max_size)
+    aio_app["inference_pool"] = InferencePool(inference_threads, max_queue)
+    aio_app.router.add_post("/predict", predict)
+    aio_app.router.add_post("/save", save)
+    aio_app.router.add_get("/metrics", metrics)
+    return aio_app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=88)
+    parser.add_argument("--inference_threads", type=int, default=4,
+                        help="threads running sess.run concurrently")
+    parser.add_argument("--max_queue", type=int, default=16,
+                        help="requests allowed to wait for an inference "
+                             "thread before new ones get a 503")
+    args = parser.parse_args()
+    web.run_app(create_app(args.inference_threads, args.max_queue),
+                host=args.host, port=args.port)
@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from six.moves import queue
+
+
+class MicroBatcher(object):
+    """Groups concurrent single-image requests into one batched sess.run.
+
+    Each caller decodes its own image on its own thread, then waits while a
+    worker thread stacks up to `max_batch_size` pending images, or whatever
+    arrived within `max_wait_ms` of the oldest one, and runs them through the
+    model together. The model's input must accept a batch dimension.
+
+    `postprocess`, if given, maps the whole [batch, classes] output to one
+    value per row, and each caller receives its row of that instead.
+
+    A request that arrives while no other one is in flight has nothing to be
+    batched with, so it skips the queue and runs the model's fused
+    decode-and-classify graph in a single sess.run instead.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=5,
+                 postprocess=None):
+        self.model = model
+        self.postprocess = postprocess
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._batches = 0
+        self._images = 0
+        self._batch_sizes = {}
+        self._queue_delay_total = 0.0
+        self._queue_delay_max = 0.0
+        self._run_time_total = 0.0
+        self._in_flight = 0
+        self._direct = 0
+
+    def predict(self, image_data):
+        with self._lock:
+            self._in_flight += 1
+            alone = self._in_flight == 1
+            if alone:
+                self._direct += 1
+        try:
+            if self.max_batch_size <= 1 or alone:
+                results = self.model.classify(image_data)
+                if self.postprocess is not None:
+                    return self.postprocess(results)[0]
+                return np.squeeze(results, 0)
+            t = self.model.preprocess(image_data)
+            future = Future()
+            self._ensure_started()
+            self._queue.put((t, time.time(), future))
+            return future.result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._loop,
+                                                name="micro-batcher")
+                self._thread.daemon = True
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0][1] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        # Past the deadline, only take what already waits.
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        start = time.time()
+        try:
+            results = self.model.run(
+                np.concatenate([t for t, _, _ in batch]))
+            if self.postprocess is not None:
+                results = self.postprocess(results)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        end = time.time()
+        with self._lock:
+            self._batches += 1
+            self._images += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(
+                len(batch), 0) + 1
+            for _, enqueued, _ in batch:
+                delay = start - enqueued
+                self._queue_delay_total += delay
+                self._queue_delay_max = max(self._queue_delay_max, delay)
+            self._run_time_total += end - start
+        for i, (_, _, future) in enumerate(batch):
+            future.set_result(results[i])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "direct": self._direct,
+                "batches": self._batches,
+                "images": self._images,
+                "batch_sizes": self._batch_sizes,
+                "mean_batch_size": self._images / max(self._batches, 1),
+                "mean_queue_delay_ms": 1000 * self._queue_delay_total /
+                max(self._images, 1),
+                "max_queue_delay_ms": 1000 * self._queue_delay_max,
+                "mean_run_ms": 1000 * self._run_time_total /
+                max(self._batches, 1)
+            }
@@ -0,0 +1,109 @@
+"""Training steps/sec reading bottlenecks from text files or the binary store.
+
+Run from the repository root:
+
+    python -m benchmarks.bottleneck_store_benchmark --images 5000 --steps 200
+
+Writes --images random bottlenecks both as legacy comma separated .txt files
+and into a BottleneckStore under a temporary directory, then times training
+steps that each sample --train_batch_size bottlenecks and run one step of a
+small softmax layer on them.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tf.tf_scripts.bottleneck_store import BottleneckStore
+from tf.tf_scripts.bottleneck_store import read_text_bottleneck
+
+
+def build_train_step(bottleneck_size, class_count):
+    graph = tf.Graph()
+    with graph.as_default():
+        bottleneck_input = tf.compat.v1.placeholder(
+            tf.float32, [None, bottleneck_size])
+        ground_truth_input = tf.compat.v1.placeholder(
+            tf.float32, [None, class_count])
+        weights = tf.Variable(tf.random.truncated_normal(
+            [bottleneck_size, class_count], stddev=0.001))
+        biases = tf.Variable(tf.zeros([class_count]))
+        logits = tf.matmul(bottleneck_input, weights) + biases
+        loss = tf.reduce_mean(
+            tf.nn.softmax_cross_entropy_with_logits(
+                labels=ground_truth_input, logits=logits))
+        train_step = tf.compat.v1.train.GradientDescentOptimizer(
+            0.01).minimize(loss)
+        init = tf.compat.v1.global_variables_initializer()
+    sess = tf.compat.v1.Session(graph=graph)
+    sess.run(init)
+    return sess, train_step, bottleneck_input, ground_truth_input
+
+
+def time_steps(sess, train_step, bottleneck_input, ground_truth_input,
+               sample, steps, batch_size, class_count):
+    random_state = np.random.RandomState(0)
+    ground_truth = np.zeros((batch_size, class_count), np.float32)
+    ground_truth[np.arange(batch_size), np.arange(batch_size) % class_count] = 1
+    start = time.time()
+    for _ in range(steps):
+        bottlenecks = sample(random_state, batch_size)
+        sess.run(train_step, feed_dict={bottleneck_input: bottlenecks,
+                                        ground_truth_input: ground_truth})
+    return steps / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=5000)
+    parser.add_argument("--bottleneck_size", type=int, default=1001)
+    parser.add_argument("--class_count", type=int, default=20)
+    parser.add_argument("--train_batch_size", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=200)
+    args = parser.parse_args()
+
+    bottleneck_dir = tempfile.mkdtemp()
+    try:
+        values = np.random.RandomState(0).rand(
+            args.images, args.bottleneck_size).astype(np.float32)
+        keys = ['image_%d.jpg' % i for i in range(args.images)]
+        for key, row in zip(keys, values):
+            with open(os.path.join(bottleneck_dir, key + '.txt'), 'w') as f:
+                f.write(','.join(str(x) for x in row))
+        store = BottleneckStore(bottleneck_dir, 'benchmark')
+        store.put_many(keys, values)
+        store.flush()
+
+        def sample_text(random_state, batch_size):
+            return [read_text_bottleneck(
+                os.path.join(bottleneck_dir, keys[i] + '.txt'))
+                for i in random_state.randint(args.images, size=batch_size)]
+
+        def sample_store(random_state, batch_size):
+            return store.get_many([
+                keys[i]
+                for i in random_state.randint(args.images, size=batch_size)])
+
+        sess, train_step, bottleneck_input, ground_truth_input = (
+            build_train_step(args.bottleneck_size, args.class_count))
+        print("{:>8} {:>12}".format("source", "steps/sec"))
+        for name, sample in [("text", sample_text), ("store", sample_store)]:
+            print("{:>8} {:>12.1f}".format(name, time_steps(
+                sess, train_step, bottleneck_input, ground_truth_input,
+                sample, args.steps, args.train_batch_size,
+                args.class_count)))
+        sess.close()
+    finally:
+        shutil.rmtree(bottleneck_dir)
+
+
+if __name__ == "__main__":
+    main()
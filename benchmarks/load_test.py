@@ -0,0 +1,141 @@
+"""Requests/sec of /predict against the number of serve.py workers.
+
+Run from the repository root:
+
+    python -m benchmarks.load_test --image tf/tf_files/uploads/leaf.png \
+        --workers 1,2,4 --concurrency 16 --requests 500
+
+For every worker count a fresh `serve.py` is started on --port, warmed up and
+then hit by --concurrency client threads.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from six.moves import urllib
+
+
+def encode_multipart(fields, file_field, file_name, file_data):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+            '{}\r\n'.format(boundary, name, value).encode("utf-8"))
+    parts.append(
+        '--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'.format(
+            boundary, file_field, file_name).encode("utf-8"))
+    parts.append(file_data)
+    parts.append('\r\n--{}--\r\n'.format(boundary).encode("utf-8"))
+    return b"".join(parts), "multipart/form-data; boundary=" + boundary
+
+
+def post_predict(url, body, content_type):
+    req = urllib.request.Request(url, data=body,
+                                 headers={"Content-Type": content_type})
+    urllib.request.urlopen(req).read()
+
+
+def wait_until_up(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/models").read()
+            return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def run_load(url, body, content_type, requests, concurrency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = [0]
+
+    def client():
+        while True:
+            with lock:
+                if counter[0] >= requests:
+                    return
+                counter[0] += 1
+            start = time.time()
+            try:
+                post_predict(url, body, content_type)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start, sorted(latencies), errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", required=True, help="image to upload")
+    parser.add_argument("--workers", type=str, default="1,2,4",
+                        help="comma separated worker counts to compare")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="request threads per worker")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--startup_timeout", type=int, default=120)
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body, content_type = encode_multipart(
+            {"id": "load-test"}, "file", "leaf.png", f.read())
+    base_url = "http://127.0.0.1:{}".format(args.port)
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>8}".format(
+        "workers", "req/s", "p50 ms", "p99 ms", "errors"))
+    for workers in [int(w) for w in args.workers.split(",")]:
+        server = subprocess.Popen([
+            sys.executable, "serve.py",
+            "--bind", "127.0.0.1:{}".format(args.port),
+            "--workers", str(workers),
+            "--threads", str(args.threads)])
+        try:
+            if not wait_until_up(base_url, args.startup_timeout):
+                print("{:>8} server did not start".format(workers))
+                continue
+            # Every worker opens its session on its first request.
+            run_load(base_url + "/predict", body, content_type,
+                     workers * args.threads * 2, args.concurrency)
+            elapsed, latencies, errors = run_load(
+                base_url + "/predict", body, content_type, args.requests,
+                args.concurrency)
+            if not latencies:
+                print("{:>8} all {} requests failed".format(
+                    workers, len(errors)))
+                continue
+            print("{:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}".format(
+                workers, len(latencies) / elapsed,
+                1000 * latencies[len(latencies) // 2],
+                1000 * latencies[min(len(latencies) - 1,
+                                     int(len(latencies) * 0.99))],
+                len(errors)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
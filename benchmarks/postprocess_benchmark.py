@@ -0,0 +1,64 @@
+"""Top-5 post-processing: per-row Python loop against build_results.
+
+Run from the repository root:
+
+    python -m benchmarks.postprocess_benchmark
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import numpy as np
+
+from leaf_labels import LabelTable, leafName
+from postprocess import build_results
+
+
+def legacy_results(probabilities, labels):
+    batch = []
+    for results in probabilities:
+        top_k = results.argsort()[-5:][::-1]
+        row = []
+        for i in top_k:
+            result = {}
+            result["leaf"] = '{}'.format(labels[i])
+            result["leafThai"] = leafName['{}'.format(labels[i])][0]
+            result["perfect"] = leafName['{}'.format(labels[i])][1]
+            result["percent"] = '{:0.2f}'.format(results[i]*100)
+            row.append(result)
+        batch.append(row)
+    return batch
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="timed runs per batch size")
+    args = parser.parse_args()
+
+    labels = sorted(leafName)
+    label_table = LabelTable(labels)
+    random_state = np.random.RandomState(0)
+
+    print("{:>6} {:>14} {:>14} {:>9}".format(
+        "batch", "loop us/batch", "numpy us/batch", "speedup"))
+    for batch_size in [1, 2, 4, 8, 16, 32, 64, 128, 256]:
+        probabilities = random_state.dirichlet(
+            np.ones(len(labels)), size=batch_size).astype(np.float32)
+        assert (legacy_results(probabilities, labels) ==
+                build_results(probabilities, label_table))
+        loop = min(timeit.repeat(
+            lambda: legacy_results(probabilities, labels),
+            number=1, repeat=args.repeat))
+        vectorized = min(timeit.repeat(
+            lambda: build_results(probabilities, label_table),
+            number=1, repeat=args.repeat))
+        print("{:>6} {:>14.1f} {:>14.1f} {:>8.2f}x".format(
+            batch_size, loop * 1e6, vectorized * 1e6, loop / vectorized))
+
+
+if __name__ == "__main__":
+    main()
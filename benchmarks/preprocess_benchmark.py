@@ -0,0 +1,70 @@
+"""Per-call latency and RSS of image preprocessing over many calls.
+
+Run from the repository root:
+
+    python -m benchmarks.preprocess_benchmark --image tf/tf_files/uploads/leaf.png
+
+With --legacy the old graph-per-call read_tensor_from_image_file behaviour is
+measured instead, which shows latency and memory growing with every call.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import time
+
+import tensorflow as tf
+
+from model_registry import current_rss
+from tf.tf_scripts.preprocess import ImagePreprocessor
+
+
+def legacy_read_tensor(image_data, input_height, input_width, input_mean,
+                       input_std):
+    image_reader = tf.image.decode_png(tf.constant(image_data), channels=3)
+    float_caster = tf.cast(image_reader, tf.float32)
+    dims_expander = tf.expand_dims(float_caster, 0)
+    resized = tf.compat.v1.image.resize_bilinear(
+        dims_expander, [input_height, input_width])
+    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
+    sess = tf.compat.v1.Session()
+    return sess.run(normalized)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", required=True, help="image to preprocess")
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--report_every", type=int, default=1000)
+    parser.add_argument("--input_size", type=int, default=224)
+    parser.add_argument("--legacy", action="store_true",
+                        help="benchmark the old graph-per-call path")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        image_data = f.read()
+    preprocessor = ImagePreprocessor(args.input_size, args.input_size, 128, 128)
+
+    print("{:>8} {:>12} {:>12} {:>10}".format(
+        "calls", "mean ms", "max ms", "rss MB"))
+    window = []
+    for i in range(1, args.calls + 1):
+        start = time.time()
+        if args.legacy:
+            legacy_read_tensor(image_data, args.input_size, args.input_size,
+                               128, 128)
+        else:
+            preprocessor.run(image_data)
+        window.append(time.time() - start)
+        if i % args.report_every == 0:
+            rss = current_rss()
+            print("{:>8} {:>12.3f} {:>12.3f} {:>10}".format(
+                i, 1000 * sum(window) / len(window), 1000 * max(window),
+                "?" if rss is None else "{:.1f}".format(rss / 2 ** 20)))
+            window = []
+    preprocessor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Training steps/sec of the retrain.py final layer with and without summaries.
+
+Run from the repository root:
+
+    python -m benchmarks.summary_benchmark --bottleneck_size 2048 --class_count 14
+
+Builds the final layer exactly as retrain.py does, with its weight, bias and
+activation histograms, and times --steps training steps that run the full
+`merged` summary and write it every step (the old behaviour), that write only
+the scalar summaries, and that run `train_step` alone.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tf.tf_scripts import retrain
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bottleneck_size", type=int, default=2048)
+    parser.add_argument("--class_count", type=int, default=14)
+    parser.add_argument("--train_batch_size", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=500)
+    args = parser.parse_args()
+
+    retrain.FLAGS = argparse.Namespace(learning_rate=0.01)
+    graph = tf.Graph()
+    with graph.as_default():
+        bottleneck_tensor = tf.compat.v1.placeholder(
+            tf.float32, [None, args.bottleneck_size])
+        (train_step, _, bottleneck_input, ground_truth_input,
+         _) = retrain.add_final_training_ops(
+            args.class_count, "final_result", bottleneck_tensor,
+            args.bottleneck_size)
+        merged = tf.compat.v1.summary.merge_all()
+        scalar_summaries = retrain.merge_scalar_summaries()
+        init = tf.compat.v1.global_variables_initializer()
+
+    random_state = np.random.RandomState(0)
+    bottlenecks = random_state.rand(
+        args.train_batch_size, args.bottleneck_size).astype(np.float32)
+    ground_truth = np.eye(args.class_count, dtype=np.float32)[
+        random_state.randint(args.class_count, size=args.train_batch_size)]
+    feed_dict = {bottleneck_input: bottlenecks,
+                 ground_truth_input: ground_truth}
+
+    summaries_dir = tempfile.mkdtemp()
+    try:
+        with tf.compat.v1.Session(graph=graph) as sess:
+            sess.run(init)
+            writer = tf.compat.v1.summary.FileWriter(summaries_dir)
+            print("{:>16} {:>12}".format("summaries", "steps/sec"))
+            for name, summary in [("all", merged),
+                                  ("scalars", scalar_summaries),
+                                  ("none", None)]:
+                start = time.time()
+                for i in range(args.steps):
+                    if summary is None:
+                        sess.run(train_step, feed_dict=feed_dict)
+                    else:
+                        train_summary, _ = sess.run([summary, train_step],
+                                                    feed_dict=feed_dict)
+                        writer.add_summary(train_summary, i)
+                writer.flush()
+                print("{:>16} {:>12.1f}".format(
+                    name, args.steps / (time.time() - start)))
+            writer.close()
+    finally:
+        shutil.rmtree(summaries_dir)
+
+
+if __name__ == "__main__":
+    main()
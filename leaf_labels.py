@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+leafPerfect = ["สมบูรณ์", "ไม่สมบูรณ์"]
+leafName = {
+    "basil_leaf": ["กระเพรา", 0],
+    "basil_leaf_notperfect": ["กระเพรา", 1],
+    "chili_leaf": ["พริก", 0],
+    "chili_leaf_notperfect": ["พริก", 1],
+    "kaffir_lime_leaf": ["มะกรูด", 0],
+    "kaffir_lime_leaf_notperfect": ["มะกรูด", 1],
+    "lemon_basil_leaf": ["แมงลัก", 0],
+    "lemon_basil_leaf_notperfect": ["แมงลัก", 1],
+    "lemon_leaf": ["มะนาว", 0],
+    "lemon_leaf_notperfect": ["มะนาว", 1],
+    "mint_leaf": ["สะระแหน่", 0],
+    "mint_leaf_notperfect": ["สะระแหน่", 1],
+    "sweet_basil_leaf": ["โหระพา", 0],
+    "sweet_basil_leaf_notperfect": ["โหระพา", 1]
+}
+
+
+def load_labels(label_file, path=False):
+    label = []
+    proto_as_ascii_lines = tf.compat.v1.gfile.GFile(label_file).readlines()
+    for l in proto_as_ascii_lines:
+        if(path):
+            label.append(l.rstrip().replace(" ", "_"))
+        else:
+            label.append(l.rstrip())
+    return label
+
+
+class LabelTable(object):
+    """Label metadata of one model, built once when the model loads.
+
+    `results[i]` holds the constant fields of a /predict result for output
+    index i, and `leafs[notperfect_leaf]` the complete `leafs` payload.
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.index = dict((label, i) for i, label in enumerate(labels))
+        self.thai = [leafName[label][0] for label in labels]
+        self.perfect = [leafName[label][1] for label in labels]
+        self.results = []
+        for i, label in enumerate(labels):
+            result = {}
+            result["leaf"] = label
+            result["leafThai"] = self.thai[i]
+            result["perfect"] = self.perfect[i]
+            self.results.append(result)
+        self.leafs = {True: [], False: []}
+        for i, label in enumerate(labels):
+            self.leafs[True].append({
+                "leaf": label,
+                "leafThai": 'ใบ{}{}'.format(
+                    self.thai[i], leafPerfect[self.perfect[i]])
+            })
+            self.leafs[False].append({
+                "leaf": label,
+                "leafThai": 'ใบ{}'.format(self.thai[i])
+            })
+
+    @classmethod
+    def from_file(cls, label_file):
+        return cls(load_labels(label_file, True))
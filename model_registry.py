@@ -0,0 +1,200 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import threading
+import time
+
+import tensorflow as tf
+
+from leaf_labels import LabelTable
+from tf.tf_scripts.preprocess import add_image_decoding
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if unknown."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+def file_version(file_name):
+    """Content hash identifying one build of a model file."""
+    sha1 = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()[:12]
+
+
+def load_serving_graph(model_file, input_layer, input_height, input_width,
+                       input_mean, input_std):
+    """Import a frozen graph behind decode/resize/normalize ops.
+
+    The returned graph takes raw encoded image bytes on `image_data` and maps
+    the normalized image onto the model's `input_layer`, so a single sess.run
+    goes from upload bytes to softmax. `serving_input` defaults to that image
+    but can be fed an already preprocessed batch instead.
+    """
+    graph = tf.compat.v1.Graph()
+    graph_def = tf.compat.v1.GraphDef()
+
+    with open(model_file, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    with graph.as_default():
+        image_data = tf.compat.v1.placeholder(tf.string, name="image_data")
+        normalized = add_image_decoding(image_data, input_height, input_width,
+                                        input_mean, input_std)
+        serving_input = tf.compat.v1.placeholder_with_default(
+            normalized, [None, input_height, input_width, 3],
+            name="serving_input")
+        tf.import_graph_def(graph_def,
+                            input_map={input_layer + ":0": serving_input})
+
+    return graph, image_data, normalized, serving_input
+
+
+class LoadedModel(object):
+    """A frozen serving graph imported once, with a long-lived session.
+
+    The graph is imported by `load()`, but the session is only opened on first
+    use in each process, so a graph loaded before forking stays shared
+    copy-on-write between workers that each run their own session.
+    """
+
+    def __init__(self, name, model_file, input_layer, output_layer,
+                 input_height=224, input_width=224, input_mean=128,
+                 input_std=128, label_file=None, session_config=None):
+        self.name = name
+        self.model_file = model_file
+        self.input_layer = input_layer
+        self.output_layer = output_layer
+        self.input_height = input_height
+        self.input_width = input_width
+        self.input_mean = input_mean
+        self.input_std = input_std
+        self.label_file = label_file
+        self.label_table = None
+        self.session_config = session_config
+        self.graph = None
+        self.image_data = None
+        self.normalized = None
+        self.serving_input = None
+        self.output_operation = None
+        self.version = None
+        self.load_time = None
+        self.memory = None
+        self.loaded_at = None
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    def load(self):
+        rss_before = current_rss()
+        start = time.time()
+        (self.graph, self.image_data, self.normalized,
+         self.serving_input) = load_serving_graph(
+            self.model_file, self.input_layer, self.input_height,
+            self.input_width, self.input_mean, self.input_std)
+        self.output_operation = self.graph.get_operation_by_name(
+            "import/" + self.output_layer)
+        self.graph.finalize()
+        self.version = file_version(self.model_file)
+        if self.label_file is not None:
+            self.label_table = LabelTable.from_file(self.label_file)
+        self.load_time = time.time() - start
+        rss_after = current_rss()
+        if rss_before is not None and rss_after is not None:
+            self.memory = rss_after - rss_before
+        self.loaded_at = time.time()
+        return self
+
+    @property
+    def session(self):
+        if self._session is None or self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = tf.compat.v1.Session(
+                        graph=self.graph, config=self.session_config)
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def classify(self, image_data):
+        return self.session.run(self.output_operation.outputs[0], {
+                                self.image_data: image_data})
+
+    def preprocess(self, image_data):
+        return self.session.run(self.normalized, {self.image_data: image_data})
+
+    def run(self, t):
+        return self.session.run(self.output_operation.outputs[0], {
+                                self.serving_input: t})
+
+    def close(self):
+        if self._session is not None and self._session_pid == os.getpid():
+            self._session.close()
+        self._session = None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "model_file": self.model_file,
+            "file_size": os.path.getsize(self.model_file),
+            "version": self.version,
+            "input": self.image_data.op.name,
+            "output": self.output_operation.name,
+            "load_time": round(self.load_time, 3),
+            "memory": self.memory,
+            "loaded_at": self.loaded_at
+        }
+
+
+class ModelRegistry(object):
+    """Keeps every loaded model for the lifetime of the process."""
+
+    def __init__(self, session_config=None):
+        self.session_config = session_config
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def set_session_config(self, session_config):
+        """Session options for models whose session is not open yet."""
+        with self._lock:
+            self.session_config = session_config
+            for model in self._models.values():
+                model.session_config = session_config
+
+    def load(self, name, **kwargs):
+        with self._lock:
+            if name not in self._models:
+                kwargs.setdefault("session_config", self.session_config)
+                model = LoadedModel(name, **kwargs)
+                self._models[name] = model.load()
+                print('Loaded model "{}" in {:.3f}s'.format(
+                    name, model.load_time))
+            return self._models[name]
+
+    def get(self, name):
+        return self._models[name]
+
+    def stats(self):
+        return {
+            "rss": current_rss(),
+            "models": [model.stats() for model in self._models.values()]
+        }
+
+    def close(self):
+        with self._lock:
+            for model in self._models.values():
+                model.close()
+            self._models.clear()
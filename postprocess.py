@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def top_k(probabilities, k=5):
+    """Indices of the k highest scores of every row, highest first."""
+    probabilities = np.atleast_2d(probabilities)
+    k = min(k, probabilities.shape[1])
+    rows = np.arange(probabilities.shape[0])[:, None]
+    partitioned = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-probabilities[rows, partitioned], axis=1,
+                       kind="stable")
+    return partitioned[rows, order]
+
+
+def build_results(probabilities, label_table, k=5):
+    """Top-k /predict result lists for every row of a [batch, classes] matrix.
+
+    Top-k selection and the percentage conversion run once over the whole
+    batch; only the final dicts are assembled per result.
+    """
+    probabilities = np.atleast_2d(probabilities)
+    indices = top_k(probabilities, k)
+    rows = np.arange(probabilities.shape[0])[:, None]
+    percents = (probabilities[rows, indices] * 100).tolist()
+    table_results = label_table.results
+    return [[dict(table_results[i], percent='%0.2f' % percent)
+             for i, percent in zip(row_indices, row_percents)]
+            for row_indices, row_percents in zip(indices.tolist(), percents)]
@@ -0,0 +1,78 @@
+"""Production entry point: pre-forked gunicorn workers sharing one graph.
+
+    python serve.py --workers 4 --threads 4
+
+app.py, and with it the frozen graph, is imported once in the master before
+the workers are forked, so the parsed graph pages stay copy-on-write shared.
+Every worker opens its own session on its first request, limited to its share
+of the cores so the workers do not oversubscribe the machine.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+
+import tensorflow as tf
+from gunicorn.app.base import BaseApplication
+
+
+class PreforkServer(BaseApplication):
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super(PreforkServer, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bind", type=str, default="0.0.0.0:88",
+                        help="address to listen on")
+    parser.add_argument("--workers", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of pre-forked worker processes")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="request threads per worker")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="TF intra-op threads per worker, 0 splits the "
+                             "cores evenly between workers")
+    parser.add_argument("--inter_op_threads", type=int, default=1,
+                        help="TF inter-op threads per worker")
+    parser.add_argument("--timeout", type=int, default=60,
+                        help="seconds before a silent worker is restarted")
+    args = parser.parse_args()
+
+    intra_op_threads = args.intra_op_threads or max(
+        1, multiprocessing.cpu_count() // args.workers)
+
+    # Loads the graph in the master, before any worker is forked.
+    import app as app_module
+    app_module.registry.set_session_config(tf.compat.v1.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=args.inter_op_threads))
+
+    print("Serving on {} with {} workers x {} threads, {} intra-op / {} "
+          "inter-op TF threads each".format(
+              args.bind, args.workers, args.threads, intra_op_threads,
+              args.inter_op_threads))
+    PreforkServer(app_module.app, {
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "preload_app": True,
+        "timeout": args.timeout,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,12 @@ from __future__ import print_function
 
 import argparse
 import collections
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 from datetime import datetime
 import hashlib
+import io
+import multiprocessing
 import os.path
 import random
 import re
@@ -18,6 +22,11 @@ import numpy as np
 from six.moves import urllib
 import tensorflow as tf
 
+from tf.tf_scripts.bottleneck_extraction import extract_bottlenecks
+from tf.tf_scripts.bottleneck_store import CachedBottlenecks
+from tf.tf_scripts.bottleneck_store import get_bottleneck_store
+from tf.tf_scripts.bottleneck_store import read_text_bottleneck
+
 FLAGS = None
 
 # These are all parameters that are tied to the particular model architecture
@@ -125,149 +134,83 @@ def create_model_graph(model_info):
     return graph, bottleneck_tensor, resized_input_tensor
 
 
-def run_bottleneck_on_image(sess, image_data, image_data_tensor,
-                            decoded_image_tensor, resized_input_tensor,
-                            bottleneck_tensor):
-    # First decode the JPEG image, resize it, and rescale the pixel values.
-    resized_input_values = sess.run(decoded_image_tensor,
-                                    {image_data_tensor: image_data})
-    # Then run it through the recognition network.
-    bottleneck_values = sess.run(bottleneck_tensor,
-                                 {resized_input_tensor: resized_input_values})
-    bottleneck_values = np.squeeze(bottleneck_values)
-    return bottleneck_values
-
-
 def ensure_dir_exists(dir_name):
     if not os.path.exists(dir_name):
         os.makedirs(dir_name)
 
 
-bottleneck_path_2_bottleneck_values = {}
-
-
-def create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                           image_dir, category, sess, jpeg_data_tensor,
-                           decoded_image_tensor, resized_input_tensor,
-                           bottleneck_tensor):
-    """Create a single bottleneck file."""
-    tf.compat.v1.logging.info('Creating bottleneck at ' + bottleneck_path)
-    image_path = get_image_path(image_lists, label_name, index,
-                                image_dir, category)
-    if not tf.compat.v1.gfile.Exists(image_path):
-        tf.compat.v1.logging.fatal('File does not exist %s', image_path)
-    image_data = tf.compat.v1.gfile.GFile(image_path, 'rb').read()
-    try:
-        bottleneck_values = run_bottleneck_on_image(
-            sess, image_data, jpeg_data_tensor, decoded_image_tensor,
-            resized_input_tensor, bottleneck_tensor)
-    except Exception as e:
-        raise RuntimeError('Error during processing file %s (%s)' % (image_path,
-                                                                     str(e)))
-    bottleneck_string = ','.join(str(x) for x in bottleneck_values)
-    with open(bottleneck_path, 'w') as bottleneck_file:
-        bottleneck_file.write(bottleneck_string)
-
-
-def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir,
-                             category, bottleneck_dir, jpeg_data_tensor,
-                             decoded_image_tensor, resized_input_tensor,
-                             bottleneck_tensor, architecture):
-    label_lists = image_lists[label_name]
-    sub_dir = label_lists['dir']
-    sub_dir_path = os.path.join(bottleneck_dir, sub_dir)
-    ensure_dir_exists(sub_dir_path)
+def get_bottleneck_key(image_lists, label_name, index, category):
+    return get_image_path(image_lists, label_name, index, '', category)
+
+
+def move_text_bottleneck(bottleneck_store, image_hash, image_lists,
+                         label_name, index, bottleneck_dir, category,
+                         architecture):
+    """Move a bottleneck cached as comma separated text into the store.
+
+    The text file is deleted once read, so it is only ever imported once.
+    """
     bottleneck_path = get_bottleneck_path(image_lists, label_name, index,
                                           bottleneck_dir, category, architecture)
     if not os.path.exists(bottleneck_path):
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               decoded_image_tensor, resized_input_tensor,
-                               bottleneck_tensor)
-    with open(bottleneck_path, 'r') as bottleneck_file:
-        bottleneck_string = bottleneck_file.read()
-    did_hit_error = False
-    try:
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    except ValueError:
+        return False
+    bottleneck_values = read_text_bottleneck(bottleneck_path)
+    if bottleneck_values is not None:
+        bottleneck_store.put(image_hash, bottleneck_values)
+    else:
         tf.compat.v1.logging.warning(
             'Invalid float found, recreating bottleneck')
-        did_hit_error = True
-    if did_hit_error:
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               decoded_image_tensor, resized_input_tensor,
-                               bottleneck_tensor)
-        with open(bottleneck_path, 'r') as bottleneck_file:
-            bottleneck_string = bottleneck_file.read()
-        # Allow exceptions to propagate here, since they shouldn't happen after a
-        # fresh creation
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    return bottleneck_values
+    os.remove(bottleneck_path)
+    return bottleneck_values is not None
 
 
 def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
                       jpeg_data_tensor, decoded_image_tensor,
-                      resized_input_tensor, bottleneck_tensor, architecture):
-    how_many_bottlenecks = 0
+                      resized_input_tensor, bottleneck_tensor, architecture,
+                      categories=('training', 'testing', 'validation'),
+                      batch_size=1):
     ensure_dir_exists(bottleneck_dir)
+    bottleneck_store = get_bottleneck_store(bottleneck_dir, architecture)
+    jobs = []
+    queued_hashes = set()
     for label_name, label_lists in image_lists.items():
-        for category in ['training', 'testing', 'validation']:
+        for category in categories:
             category_list = label_lists[category]
             for index, unused_base_name in enumerate(category_list):
-                get_or_create_bottleneck(
-                    sess, image_lists, label_name, index, image_dir, category,
-                    bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                    resized_input_tensor, bottleneck_tensor, architecture)
-
-                how_many_bottlenecks += 1
-                if how_many_bottlenecks % 100 == 0:
-                    tf.compat.v1.logging.info(
-                        str(how_many_bottlenecks) + ' bottleneck files created.')
-
-
-def get_random_cached_bottlenecks(sess, image_lists, how_many, category,
-                                  bottleneck_dir, image_dir, jpeg_data_tensor,
-                                  decoded_image_tensor, resized_input_tensor,
-                                  bottleneck_tensor, architecture):
-    class_count = len(image_lists.keys())
-    bottlenecks = []
-    ground_truths = []
-    filenames = []
-    if how_many >= 0:
-        # Retrieve a random sample of bottlenecks.
-        for unused_i in range(how_many):
-            label_index = random.randrange(class_count)
-            label_name = list(image_lists.keys())[label_index]
-            image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
-            image_name = get_image_path(image_lists, label_name, image_index,
-                                        image_dir, category)
-            bottleneck = get_or_create_bottleneck(
-                sess, image_lists, label_name, image_index, image_dir, category,
-                bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                resized_input_tensor, bottleneck_tensor, architecture)
-            ground_truth = np.zeros(class_count, dtype=np.float32)
-            ground_truth[label_index] = 1.0
-            bottlenecks.append(bottleneck)
-            ground_truths.append(ground_truth)
-            filenames.append(image_name)
-    else:
-        # Retrieve all bottlenecks.
-        for label_index, label_name in enumerate(image_lists.keys()):
-            for image_index, image_name in enumerate(
-                    image_lists[label_name][category]):
-                image_name = get_image_path(image_lists, label_name, image_index,
+                bottleneck_key = get_bottleneck_key(image_lists, label_name,
+                                                    index, category)
+                image_path = get_image_path(image_lists, label_name, index,
                                             image_dir, category)
-                bottleneck = get_or_create_bottleneck(
-                    sess, image_lists, label_name, image_index, image_dir, category,
-                    bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                    resized_input_tensor, bottleneck_tensor, architecture)
-                ground_truth = np.zeros(class_count, dtype=np.float32)
-                ground_truth[label_index] = 1.0
-                bottlenecks.append(bottleneck)
-                ground_truths.append(ground_truth)
-                filenames.append(image_name)
-    return bottlenecks, ground_truths, filenames
+                # A legacy text bottleneck can only belong to the image's
+                # content from before the store knew the image; once the
+                # manifest has an entry, it may predate an overwrite.
+                previously_hashed = bottleneck_key in bottleneck_store.files
+                image_hash = bottleneck_store.image_hash(bottleneck_key,
+                                                         image_path)
+                if (image_hash in bottleneck_store or
+                        image_hash in queued_hashes or
+                        (not previously_hashed and
+                         move_text_bottleneck(bottleneck_store, image_hash,
+                                              image_lists, label_name, index,
+                                              bottleneck_dir, category,
+                                              architecture))):
+                    continue
+                queued_hashes.add(image_hash)
+                jobs.append((image_hash, image_path))
+    tf.compat.v1.logging.info('%d new or changed images need bottlenecks',
+                              len(jobs))
+    extract_bottlenecks(sess, jobs, bottleneck_store, jpeg_data_tensor,
+                        decoded_image_tensor, resized_input_tensor,
+                        bottleneck_tensor, batch_size)
+    # Drop bottlenecks of images that were deleted or changed since.
+    dropped = bottleneck_store.collect_garbage(
+        get_bottleneck_key(image_lists, label_name, index, category)
+        for label_name, label_lists in image_lists.items()
+        for category in ['training', 'testing', 'validation']
+        for index in range(len(label_lists[category])))
+    if dropped:
+        tf.compat.v1.logging.info('Removed %d stale bottlenecks', dropped)
+    bottleneck_store.flush()
 
 
 def get_random_distorted_bottlenecks(
@@ -311,7 +254,7 @@ def add_input_distortions(flip_left_right, random_crop, random_scale,
                           input_depth, input_mean, input_std):
 
     jpeg_data = tf.compat.v1.placeholder(
-        tf.tf.compat.v1, name='DistortJPGInput')
+        tf.compat.v1.string, name='DistortJPGInput')
     decoded_image = tf.compat.v1.image.decode_jpeg(
         jpeg_data, channels=input_depth)
     decoded_image_as_float = tf.compat.v1.cast(
@@ -367,6 +310,14 @@ def variable_summaries(var):
         tf.compat.v1.summary.histogram('histogram', var)
 
 
+def merge_scalar_summaries():
+    """Merge only the scalar summaries, leaving out the costly histograms."""
+    return tf.compat.v1.summary.merge([
+        summary for summary in tf.compat.v1.get_collection(
+            tf.compat.v1.GraphKeys.SUMMARIES)
+        if summary.op.type == 'ScalarSummary'])
+
+
 def add_final_training_ops(class_count, final_tensor_name, bottleneck_tensor,
                            bottleneck_tensor_size, learning_rate):
     with tf.compat.v1.name_scope('input'):
@@ -432,6 +383,212 @@ def add_evaluation_step(result_tensor, ground_truth_tensor):
     return evaluation_step, prediction
 
 
+def add_stacked_final_training_ops(class_count, final_tensor_name,
+                                   bottleneck_tensor, bottleneck_tensor_size,
+                                   head_count):
+    """K final layers, one per fed learning rate, trained by one train_step.
+
+    The weights are stacked into one [K, bottleneck_tensor_size, class_count]
+    variable. Plain gradient descent with rate 1 on the sum of every layer's
+    cross entropy scaled by its learning rate gives each layer exactly the
+    update it would get from its own optimizer.
+
+    A regular final layer with the usual names is built as well; running
+    `export_head` with `head_index` fed copies layer k into it, so the graph
+    can be exported by save_graph_to_file like a single-rate one.
+    """
+    with tf.compat.v1.name_scope('input'):
+        bottleneck_input = tf.compat.v1.placeholder_with_default(
+            bottleneck_tensor,
+            shape=[None, bottleneck_tensor_size],
+            name='BottleneckInputPlaceholder')
+
+        ground_truth_input = tf.compat.v1.placeholder(tf.compat.v1.float32,
+                                                      [None, class_count],
+                                                      name='GroundTruthInput')
+
+        learning_rate_input = tf.compat.v1.placeholder(
+            tf.compat.v1.float32, [head_count], name='LearningRateInput')
+
+    with tf.compat.v1.name_scope('stacked_final_training_ops'):
+        with tf.compat.v1.name_scope('weights'):
+            initial_value = tf.compat.v1.random.truncated_normal(
+                [head_count, bottleneck_tensor_size, class_count], stddev=0.001)
+            stacked_weights = tf.compat.v1.Variable(
+                initial_value, name='stacked_weights')
+            variable_summaries(stacked_weights)
+        with tf.compat.v1.name_scope('biases'):
+            stacked_biases = tf.compat.v1.Variable(
+                tf.compat.v1.zeros([head_count, class_count]),
+                name='stacked_biases')
+            variable_summaries(stacked_biases)
+        with tf.compat.v1.name_scope('Wx_plus_b'):
+            logits = tf.compat.v1.einsum(
+                'bi,kic->kbc', bottleneck_input, stacked_weights) + (
+                tf.compat.v1.expand_dims(stacked_biases, 1))
+            tf.compat.v1.summary.histogram('pre_activations', logits)
+    stacked_result = tf.nn.softmax(logits)
+
+    with tf.compat.v1.name_scope('cross_entropy'):
+        ground_truth = tf.compat.v1.tile(
+            tf.compat.v1.expand_dims(ground_truth_input, 0),
+            [head_count, 1, 1])
+        cross_entropy = tf.compat.v2.nn.softmax_cross_entropy_with_logits(
+            labels=ground_truth, logits=logits)
+        with tf.compat.v1.name_scope('total'):
+            cross_entropy_means = tf.compat.v1.reduce_mean(cross_entropy, 1)
+    for k in range(head_count):
+        tf.compat.v1.summary.scalar('cross_entropy_%d' % k,
+                                    cross_entropy_means[k])
+
+    with tf.compat.v1.name_scope('train'):
+        scaled_loss = tf.compat.v1.reduce_sum(
+            learning_rate_input * cross_entropy_means)
+        optimizer = tf.compat.v1.train.GradientDescentOptimizer(1.0)
+        train_step = optimizer.minimize(scaled_loss)
+
+    with tf.compat.v1.name_scope('final_training_ops'):
+        with tf.compat.v1.name_scope('weights'):
+            layer_weights = tf.compat.v1.Variable(
+                tf.compat.v1.zeros([bottleneck_tensor_size, class_count]),
+                name='final_weights')
+        with tf.compat.v1.name_scope('biases'):
+            layer_biases = tf.compat.v1.Variable(
+                tf.compat.v1.zeros([class_count]), name='final_biases')
+        with tf.compat.v1.name_scope('Wx_plus_b'):
+            head_logits = tf.compat.v1.matmul(
+                bottleneck_input, layer_weights) + layer_biases
+    tf.nn.softmax(head_logits, name=final_tensor_name)
+    head_index = tf.compat.v1.placeholder(tf.compat.v1.int32, [],
+                                          name='ExportHeadIndex')
+    export_head = tf.compat.v1.group(
+        layer_weights.assign(stacked_weights[head_index]),
+        layer_biases.assign(stacked_biases[head_index]))
+
+    return (train_step, cross_entropy_means, bottleneck_input,
+            ground_truth_input, learning_rate_input, stacked_result,
+            export_head, head_index)
+
+
+def add_stacked_evaluation_step(stacked_result, ground_truth_tensor,
+                                head_count):
+    with tf.compat.v1.name_scope('accuracy'):
+        with tf.compat.v1.name_scope('correct_prediction'):
+            prediction = tf.argmax(stacked_result, 2)
+            correct_prediction = tf.compat.v1.equal(
+                prediction, tf.compat.v1.expand_dims(
+                    tf.compat.v1.argmax(ground_truth_tensor, 1), 0))
+        with tf.compat.v1.name_scope('accuracy'):
+            evaluation_step = tf.compat.v1.reduce_mean(
+                tf.compat.v1.cast(correct_prediction, tf.compat.v1.float32), 1)
+    for k in range(head_count):
+        tf.compat.v1.summary.scalar('accuracy_%d' % k, evaluation_step[k])
+    return evaluation_step, prediction
+
+
+class SweepGraph(object):
+    """Base model, decoding ops and final layer of one architecture.
+
+    Building it parses the base model's .pb file, so the sweep jobs of a
+    process share one and only reset the final layer between runs. The
+    learning rate is fed to `train_step` instead of being part of the graph.
+    """
+
+    def __init__(self, model_info, class_count, head_count=None,
+                 intra_op_threads=0):
+        self.graph, self.bottleneck_tensor, self.resized_image_tensor = (
+            create_model_graph(model_info))
+        self.sess = tf.compat.v1.Session(
+            graph=self.graph, config=tf.compat.v1.ConfigProto(
+                intra_op_parallelism_threads=intra_op_threads))
+        with self.graph.as_default():
+            if FLAGS.random_seed is not None:
+                tf.compat.v1.set_random_seed(FLAGS.random_seed)
+            # Set up the image decoding sub-graph.
+            self.jpeg_data_tensor, self.decoded_image_tensor = add_jpeg_decoding(
+                model_info['input_width'], model_info['input_height'],
+                model_info['input_depth'], model_info['input_mean'],
+                model_info['input_std'])
+            if should_distort_images(FLAGS.flip_left_right, FLAGS.random_crop,
+                                     FLAGS.random_scale, FLAGS.random_brightness):
+                (self.distorted_jpeg_data_tensor,
+                 self.distorted_image_tensor) = add_input_distortions(
+                    FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
+                    FLAGS.random_brightness, model_info['input_width'],
+                    model_info['input_height'], model_info['input_depth'],
+                    model_info['input_mean'], model_info['input_std'])
+            variables_before = set(tf.compat.v1.global_variables())
+            if head_count:
+                (self.train_step, self.cross_entropy, self.bottleneck_input,
+                 self.ground_truth_input, self.learning_rate_input,
+                 stacked_result, self.export_head, self.head_index) = (
+                    add_stacked_final_training_ops(
+                        class_count, FLAGS.final_tensor_name,
+                        self.bottleneck_tensor,
+                        model_info['bottleneck_tensor_size'], head_count))
+                self.evaluation_step, self.prediction = (
+                    add_stacked_evaluation_step(
+                        stacked_result, self.ground_truth_input, head_count))
+            else:
+                self.learning_rate_input = tf.compat.v1.placeholder(
+                    tf.compat.v1.float32, [], name='LearningRateInput')
+                (self.train_step, self.cross_entropy, self.bottleneck_input,
+                 self.ground_truth_input, final_tensor) = add_final_training_ops(
+                    class_count, FLAGS.final_tensor_name,
+                    self.bottleneck_tensor,
+                    model_info['bottleneck_tensor_size'],
+                    self.learning_rate_input)
+                self.evaluation_step, self.prediction = add_evaluation_step(
+                    final_tensor, self.ground_truth_input)
+                self.export_head = None
+                self.head_index = None
+            self.merged = tf.compat.v1.summary.merge_all()
+            self.scalar_summaries = merge_scalar_summaries()
+            self.final_variables = [
+                variable for variable in tf.compat.v1.global_variables()
+                if variable not in variables_before]
+            self.init = tf.compat.v1.variables_initializer(
+                self.final_variables)
+        self.initial_values = None
+
+    def reset(self):
+        """Fresh final layer weights, the same ones every run with a seed."""
+        self.sess.run(self.init)
+        if FLAGS.random_seed is not None:
+            if self.initial_values is None:
+                self.initial_values = self.sess.run(self.final_variables)
+            for variable, value in zip(self.final_variables,
+                                       self.initial_values):
+                variable.load(value, self.sess)
+
+    def close(self):
+        self.sess.close()
+
+
+_sweep_graphs = {}
+
+
+def get_sweep_graph(model_name, model_info, class_count, head_count=None,
+                    intra_op_threads=0):
+    """The process' SweepGraph of `model_name`, rebuilt if its shape changed."""
+    key = (class_count, head_count, intra_op_threads)
+    cached = _sweep_graphs.get(model_name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    sweep_graph = SweepGraph(model_info, class_count, head_count,
+                             intra_op_threads)
+    _sweep_graphs[model_name] = (key, sweep_graph)
+    return sweep_graph
+
+
+def close_sweep_graphs():
+    for _, sweep_graph in _sweep_graphs.values():
+        sweep_graph.close()
+    _sweep_graphs.clear()
+
+
 def save_graph_to_file(sess, graph, graph_file_name):
     output_graph_def = tf.compat.v1.graph_util.convert_variables_to_constants(
         sess, graph.as_graph_def(), [FLAGS.final_tensor_name])
@@ -440,6 +597,13 @@ def save_graph_to_file(sess, graph, graph_file_name):
     return
 
 
+def step_random_state(step):
+    """Random state for evaluation batches, fixed per step by --random_seed."""
+    if FLAGS.random_seed is None:
+        return None
+    return np.random.RandomState(FLAGS.random_seed + step)
+
+
 def prepare_file_system(summaries_dir):
     # Setup the directory we'll write summaries to for TensorBoard
     if tf.compat.v1.gfile.Exists(summaries_dir):
@@ -523,6 +687,308 @@ def add_jpeg_decoding(input_width, input_height, input_depth, input_mean,
     return jpeg_data, mul_image
 
 
+def run_sweep_job(flags, model_name, image_lists, percent_test_validate,
+                  learning_rates, training_step_list, intra_op_threads=0):
+    """Train the final layer for some grid points and return their CSV rows.
+
+    `learning_rates` has one learning rate, or several trained side by side
+    with --vectorize_learning_rates.
+
+    Runs in a sweep worker process, which only reads the bottleneck store
+    filled by main() before the sweep started.
+    """
+    global FLAGS
+    FLAGS = flags
+    # Needed to make sure the logging output is visible.
+    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
+    model_info = create_model_info(model_name)
+    # See if the command-line flags mean we're applying any distortions.
+    do_distort_images = should_distort_images(
+        FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
+        FLAGS.random_brightness)
+    row = {
+        'model name': model_name,
+        'percent test': percent_test_validate
+    }
+    rows = []
+    load_start = time.time()
+    sweep_graph = get_sweep_graph(
+        model_name, model_info, len(image_lists.keys()),
+        len(learning_rates) if FLAGS.vectorize_learning_rates else None,
+        intra_op_threads)
+    row['load time'] = round(time.time() - load_start, 2)
+    tf.compat.v1.logging.info('Base graph of %s ready after %.2fs',
+                              model_name, row['load time'])
+    graph = sweep_graph.graph
+    sess = sweep_graph.sess
+    bottleneck_tensor = sweep_graph.bottleneck_tensor
+    resized_image_tensor = sweep_graph.resized_image_tensor
+    bottleneck_input = sweep_graph.bottleneck_input
+    ground_truth_input = sweep_graph.ground_truth_input
+    train_step = sweep_graph.train_step
+    cross_entropy = sweep_graph.cross_entropy
+    evaluation_step = sweep_graph.evaluation_step
+    prediction = sweep_graph.prediction
+    merged = sweep_graph.merged
+    if FLAGS.vectorize_learning_rates:
+        learning_rate_value = learning_rates
+    else:
+        (learning_rate_value,) = learning_rates
+    with graph.as_default():
+        if do_distort_images:
+            distorted_jpeg_data_tensor = sweep_graph.distorted_jpeg_data_tensor
+            distorted_image_tensor = sweep_graph.distorted_image_tensor
+            cached_categories = ['testing', 'validation']
+        else:
+            cached_categories = ['training', 'testing', 'validation']
+        # main() cached the bottlenecks before the sweep started. Batches are
+        # read from the store's memory map, which every sweep worker shares.
+        bottleneck_store = get_bottleneck_store(FLAGS.bottleneck_dir,
+                                                model_name)
+        cached_bottlenecks = dict(
+            (category, CachedBottlenecks(bottleneck_store, image_lists,
+                                         category, FLAGS.image_dir,
+                                         in_memory=False))
+            for category in cached_categories)
+
+        def save_head_graph(k, graph_file_name):
+            # The exported layer of a vectorized run is loaded from its head
+            # first, so every graph has the usual final layer names.
+            if sweep_graph.export_head is not None:
+                sess.run(sweep_graph.export_head,
+                         feed_dict={sweep_graph.head_index: k})
+            save_graph_to_file(sess, graph, graph_file_name)
+
+        # Train once up to the largest step count and snapshot every
+        # requested count on the way, unless asked to restart each one.
+        snapshot_steps = sorted(training_step_list)
+        if FLAGS.train_from_scratch_per_step:
+            training_runs = [[step] for step in snapshot_steps]
+        else:
+            training_runs = [snapshot_steps]
+        for run_steps in training_runs:
+            summaries_dir = 'tf/tf_files/training_summaries/{}-PT{}-LR{}-TS{}/'.format(
+                model_name, percent_test_validate,
+                '_'.join(str(learning_rate) for learning_rate in learning_rates),
+                run_steps[-1])
+            # Prepare necessary directories  that can be used during training
+            prepare_file_system(summaries_dir)
+            # Write the summaries merged by the sweep graph to the summaries_dir
+            train_writer = tf.compat.v1.summary.FileWriter(summaries_dir + '/train',
+                                                           sess.graph)
+
+            validation_writer = tf.compat.v1.summary.FileWriter(
+                summaries_dir + '/validation')
+
+            start = time.time()
+            # Set up all our weights to their initial default values.
+            sweep_graph.reset()
+            if FLAGS.random_seed is not None:
+                # Every run starts from the same weights and batches.
+                random.seed(FLAGS.random_seed)
+                cached_bottlenecks['training'].random_state = (
+                    np.random.RandomState(FLAGS.random_seed))
+
+            # Run the training for as many cycles as requested on the command line.
+            for i in range(run_steps[-1]):
+                # Get a batch of input bottleneck values, either calculated fresh every
+                # time with distortions applied, or from the cache stored on disk.
+                if do_distort_images:
+                    (train_bottlenecks,
+                     train_ground_truth) = get_random_distorted_bottlenecks(
+                        sess, image_lists, FLAGS.train_batch_size, 'training',
+                        FLAGS.image_dir, distorted_jpeg_data_tensor,
+                        distorted_image_tensor, resized_image_tensor, bottleneck_tensor)
+                else:
+                    (train_bottlenecks,
+                     train_ground_truth, _) = cached_bottlenecks['training'].sample(
+                        FLAGS.train_batch_size)
+                # Feed the bottlenecks and ground truth into the graph, and run a training
+                # step. Capture training summaries for TensorBoard with the `merged` op
+                # on evaluation steps, and only the scalars every --summary_interval.
+                is_snapshot_step = (i + 1) in run_steps
+                is_eval_step = (i % FLAGS.eval_step_interval) == 0 or is_snapshot_step
+                train_feed_dict = {bottleneck_input: train_bottlenecks,
+                                   ground_truth_input: train_ground_truth,
+                                   sweep_graph.learning_rate_input: learning_rate_value}
+                if is_eval_step:
+                    train_summary, _ = sess.run([merged, train_step],
+                                                feed_dict=train_feed_dict)
+                    train_writer.add_summary(train_summary, i)
+                elif FLAGS.summary_interval > 0 and i % FLAGS.summary_interval == 0:
+                    train_summary, _ = sess.run(
+                        [sweep_graph.scalar_summaries, train_step],
+                        feed_dict=train_feed_dict)
+                    train_writer.add_summary(train_summary, i)
+                else:
+                    sess.run(train_step, feed_dict=train_feed_dict)
+
+                # Every so often, print out how well the graph is training.
+                if is_eval_step:
+                    # Metrics come back with one value per learning rate.
+                    train_accuracies, cross_entropy_values = sess.run(
+                        [evaluation_step, cross_entropy],
+                        feed_dict={bottleneck_input: train_bottlenecks,
+                                   ground_truth_input: train_ground_truth})
+                    validation_bottlenecks, validation_ground_truth, _ = (
+                        cached_bottlenecks['validation'].sample(
+                            FLAGS.validation_batch_size,
+                            step_random_state(i)))
+                    # Run a validation step and capture training summaries for TensorBoard
+                    # with the `merged` op.
+                    validation_summary, validation_accuracies = sess.run(
+                        [merged, evaluation_step],
+                        feed_dict={bottleneck_input: validation_bottlenecks,
+                                   ground_truth_input: validation_ground_truth})
+                    validation_writer.add_summary(
+                        validation_summary, i)
+                    train_accuracies = np.reshape(train_accuracies, [-1])
+                    cross_entropy_values = np.reshape(cross_entropy_values, [-1])
+                    validation_accuracies = np.reshape(validation_accuracies, [-1])
+                    for k, learning_rate in enumerate(learning_rates):
+                        tf.compat.v1.logging.info('%s: Step %d: LR %s: Train accuracy = %.2f%%' %
+                                                  (datetime.now(), i, learning_rate,
+                                                   train_accuracies[k] * 100))
+                        tf.compat.v1.logging.info('%s: Step %d: LR %s: Cross entropy = %f' %
+                                                  (datetime.now(), i, learning_rate,
+                                                   cross_entropy_values[k]))
+                        tf.compat.v1.logging.info('%s: Step %d: LR %s: Validation accuracy = %.1f%% (N=%d)' %
+                                                  (datetime.now(), i, learning_rate,
+                                                   validation_accuracies[k] * 100,
+                                                   len(validation_bottlenecks)))
+                # Store intermediate results
+                intermediate_frequency = FLAGS.intermediate_store_frequency
+
+                if (intermediate_frequency > 0 and (i % intermediate_frequency == 0)
+                        and i > 0):
+                    for k, learning_rate in enumerate(learning_rates):
+                        intermediate_file_name = (FLAGS.intermediate_output_graphs_dir +
+                                                  'intermediate_' + str(i) + '.pb')
+                        if sweep_graph.export_head is not None:
+                            intermediate_file_name = intermediate_file_name.replace(
+                                '.pb', '-LR{}.pb'.format(learning_rate))
+                        tf.compat.v1.logging.info('Save intermediate result to : ' +
+                                                  intermediate_file_name)
+                        save_head_graph(k, intermediate_file_name)
+
+                if not is_snapshot_step:
+                    continue
+                training_step = i + 1
+                row['training step'] = training_step
+                # Run a test evaluation on some new images we haven't used before
+                # with the weights as they are after this many steps.
+                test_bottlenecks, test_ground_truth, test_filenames = (
+                    cached_bottlenecks['testing'].sample(
+                        FLAGS.test_batch_size, step_random_state(i)))
+                test_accuracies, predictions = sess.run(
+                    [evaluation_step, prediction],
+                    feed_dict={bottleneck_input: test_bottlenecks,
+                               ground_truth_input: test_ground_truth})
+                test_accuracies = np.reshape(test_accuracies, [-1])
+                predictions = np.reshape(predictions, [len(learning_rates), -1])
+                end = time.time()
+                for k, learning_rate in enumerate(learning_rates):
+                    tf.compat.v1.logging.info('LR %s: Final test accuracy = %.2f%% (N=%d)' %
+                                              (learning_rate, test_accuracies[k] * 100,
+                                               len(test_bottlenecks)))
+
+                    if FLAGS.print_misclassified_test_images:
+                        tf.compat.v1.logging.info(
+                            '=== MISCLASSIFIED TEST IMAGES ===')
+                        for j, test_filename in enumerate(test_filenames):
+                            if predictions[k][j] != test_ground_truth[j].argmax():
+                                tf.compat.v1.logging.info('%70s  %s' %
+                                                          (test_filename,
+                                                           list(image_lists.keys())[predictions[k][j]]))
+                    # Write out the trained graph and labels with the weights stored as
+                    # constants.
+                    output_graph = 'tf/tf_files/retrained_graphs/retrained_graph_{}-PT{}-LR{}-TS{}.pb'.format(
+                        model_name, percent_test_validate, learning_rate, training_step)
+                    save_head_graph(k, output_graph)
+                    row['learning rate'] = learning_rate
+                    row['train accuracy'] = '{:.2f}'.format(
+                        train_accuracies[k] * 100)
+                    row['cross entropy'] = '{:.2f}'.format(
+                        cross_entropy_values[k])
+                    row['validation accuracy'] = '{:.2f}'.format(
+                        validation_accuracies[k] * 100)
+                    row['final test accuracy'] = '{:.2f}'.format(
+                        test_accuracies[k] * 100)
+                    row['time'] = round(end - start, 2)
+                    rows.append(dict(row))
+    return rows
+
+
+
+def cache_sweep_bottlenecks(sweep_graph, model_name, image_lists, categories):
+    """Fill the bottleneck store of one model before the sweep reads it."""
+    cache_bottlenecks(sweep_graph.sess, image_lists, FLAGS.image_dir,
+                      FLAGS.bottleneck_dir, sweep_graph.jpeg_data_tensor,
+                      sweep_graph.decoded_image_tensor,
+                      sweep_graph.resized_image_tensor,
+                      sweep_graph.bottleneck_tensor, model_name, categories,
+                      FLAGS.bottleneck_batch_size)
+
+
+def sweep_key(model_name, percent_test_validate, learning_rate,
+              training_step):
+    return (str(model_name), str(percent_test_validate), str(learning_rate),
+            str(training_step))
+
+
+def open_results_csv(csv_path, fieldnames):
+    """Open `csv_path` to append sweep rows to, keeping finished ones.
+
+    A row cut short by an interrupted sweep is dropped, and rows written
+    with older columns are rewritten under `fieldnames`. Returns the file,
+    the grid points it already has and the last row number used.
+    """
+    finished = set()
+    last_no = 0
+    if os.path.exists(csv_path):
+        with open(csv_path, 'r', newline='') as f:
+            content = f.read()
+        content = content[:content.rfind('\n') + 1]
+        rows = list(csv.DictReader(io.StringIO(content)))
+        for row in rows:
+            finished.add(sweep_key(row['model name'], row['percent test'],
+                                   row['learning rate'],
+                                   row['training step']))
+            last_no = max(last_no, int(row['NO']))
+        # Rewrite a half-written last row away, or older rows under the
+        # current columns.
+        if content.split('\n', 1)[0].rstrip('\r') != ','.join(fieldnames) or (
+                len(content) != os.path.getsize(csv_path)):
+            with open(csv_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames,
+                                        extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(rows)
+    csv_file = open(csv_path, 'a', newline='')
+    if csv_file.tell() == 0:
+        csv.DictWriter(csv_file, fieldnames=fieldnames).writeheader()
+    return csv_file, finished, last_no
+
+
+def write_results(csv_file, fieldnames, rows, finished, last_no):
+    """Append the new rows of one finished job in a single write."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    for row in rows:
+        key = sweep_key(row['model name'], row['percent test'],
+                        row['learning rate'], row['training step'])
+        if key in finished:
+            continue
+        finished.add(key)
+        last_no += 1
+        row['NO'] = last_no
+        writer.writerow(row)
+    csv_file.write(buffer.getvalue())
+    csv_file.flush()
+    os.fsync(csv_file.fileno())
+    return last_no
+
+
 def main(_):
     # Needed to make sure the logging output is visible.
     tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
@@ -537,27 +1003,23 @@ def main(_):
     learning_rate_list = [0.0001]
     training_step_list = [100]
     testing_and_validating_percentage_list = [10]
-    NO = 1
-
-    with open("tests.csv", "w", newline="") as f:
-        fieldnames = ['NO', 'model name', 'percent test', 'learning rate', 'training step',
-                      'train accuracy', 'cross entropy', 'validation accuracy', 'final test accuracy', 'time']
-        TheWriter = csv.DictWriter(f, fieldnames=fieldnames)
-        TheWriter.writeheader()
-        row = {
-            'NO': NO,
-            'model name': None,
-            'percent test': None,
-            'learning rate': None,
-            'training step': None,
-            'train accuracy': None,
-            'cross entropy': None,
-            'validation accuracy': None,
-            'final test accuracy': None,
-            'time': None
-        }
+
+    fieldnames = ['NO', 'model name', 'percent test', 'learning rate', 'training step',
+                  'train accuracy', 'cross entropy', 'validation accuracy', 'final test accuracy', 'time',
+                  'load time']
+    # See if the command-line flags mean we're applying any distortions.
+    if should_distort_images(FLAGS.flip_left_right, FLAGS.random_crop,
+                             FLAGS.random_scale, FLAGS.random_brightness):
+        cached_categories = ['testing', 'validation']
+    else:
+        cached_categories = ['training', 'testing', 'validation']
+
+    csv_file, finished, NO = open_results_csv("tests.csv", fieldnames)
+    # Seconds main() spent loading each architecture's base graph.
+    graph_load_times = {}
+    with csv_file:
+        jobs = []
         for model_name in model_name_list:
-            row['model name'] = model_name
             # Gather information about the model architecture we'll be using.
             model_info = create_model_info(model_name)
             if not model_info:
@@ -565,7 +1027,6 @@ def main(_):
                     'Did not recognize architecture flag')
                 return -1
             for percent_test_validate in testing_and_validating_percentage_list:
-                row['percent test'] = percent_test_validate
                 # Look at the folder structure, and create lists of all the images.
                 image_lists = create_image_lists(FLAGS.image_dir, percent_test_validate,
                                                  percent_test_validate)
@@ -579,177 +1040,79 @@ def main(_):
                                                FLAGS.image_dir +
                                                ' - multiple classes are needed for classification.')
                     return -1
-                    # See if the command-line flags mean we're applying any distortions.
-                do_distort_images = should_distort_images(
-                    FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
-                    FLAGS.random_brightness)
-
-                for learning_rate in learning_rate_list:
-                    row['learning rate'] = learning_rate
-                    graph, bottleneck_tensor, resized_image_tensor = (
-                        create_model_graph(model_info))
-                    # tf.compat.v1.reset_default_graph()
-                    # _ = tf.compat.v1.Variable(0)
-                    with tf.compat.v1.Session(graph=graph) as sess:
-                        # Set up the image decoding sub-graph.
-                        jpeg_data_tensor, decoded_image_tensor = add_jpeg_decoding(
-                            model_info['input_width'], model_info['input_height'],
-                            model_info['input_depth'], model_info['input_mean'],
-                            model_info['input_std'])
-                        if do_distort_images:
-                            # We will be applying distortions, so setup the operations we'll need.
-                            (distorted_jpeg_data_tensor,
-                             distorted_image_tensor) = add_input_distortions(
-                                FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
-                                FLAGS.random_brightness, model_info['input_width'],
-                                model_info['input_height'], model_info['input_depth'],
-                                model_info['input_mean'], model_info['input_std'])
-                        else:
-                            # We'll make sure we've calculated the 'bottleneck' image summaries and
-                            # cached them on disk.
-                            cache_bottlenecks(sess, image_lists, FLAGS.image_dir,
-                                              FLAGS.bottleneck_dir, jpeg_data_tensor,
-                                              decoded_image_tensor, resized_image_tensor,
-                                              bottleneck_tensor, model_name)
-
-                        # Add the new layer that we'll be training.
-                        (train_step, cross_entropy, bottleneck_input, ground_truth_input,
-                         final_tensor) = add_final_training_ops(
-                            len(image_lists.keys()
-                                ), FLAGS.final_tensor_name, bottleneck_tensor,
-                            model_info['bottleneck_tensor_size'], learning_rate)
-
-                        # Create the operations we need to evaluate the accuracy of our new layer.
-                        evaluation_step, prediction = add_evaluation_step(
-                            final_tensor, ground_truth_input)
-                        for training_step in training_step_list:
-                            row['training step'] = training_step
-                            summaries_dir = 'tf/tf_files/training_summaries/{}-PT{}-LR{}-TS{}/'.format(
-                                model_name, percent_test_validate, learning_rate, training_step)
-                            # Prepare necessary directories  that can be used during training
-                            prepare_file_system(summaries_dir)
-                            # Merge all the summaries and write them out to the summaries_dir
-                            merged = tf.compat.v1.summary.merge_all()
-                            train_writer = tf.compat.v1.summary.FileWriter(summaries_dir + '/train',
-                                                                           sess.graph)
-
-                            validation_writer = tf.compat.v1.summary.FileWriter(
-                                summaries_dir + '/validation')
-
-                            start = time.time()
-                            # Set up all our weights to their initial default values.
-                            init = tf.compat.v1.global_variables_initializer()
-                            sess.run(init)
-
-                            # Run the training for as many cycles as requested on the command line.
-                            for i in range(training_step):
-                                # Get a batch of input bottleneck values, either calculated fresh every
-                                # time with distortions applied, or from the cache stored on disk.
-                                if do_distort_images:
-                                    (train_bottlenecks,
-                                     train_ground_truth) = get_random_distorted_bottlenecks(
-                                        sess, image_lists, FLAGS.train_batch_size, 'training',
-                                        FLAGS.image_dir, distorted_jpeg_data_tensor,
-                                        distorted_image_tensor, resized_image_tensor, bottleneck_tensor)
-                                else:
-                                    (train_bottlenecks,
-                                     train_ground_truth, _) = get_random_cached_bottlenecks(
-                                        sess, image_lists, FLAGS.train_batch_size, 'training',
-                                        FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                                        decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                                        model_name)
-                                # Feed the bottlenecks and ground truth into the graph, and run a training
-                                # step. Capture training summaries for TensorBoard with the `merged` op.
-                                train_summary, _ = sess.run(
-                                    [merged, train_step],
-                                    feed_dict={bottleneck_input: train_bottlenecks,
-                                               ground_truth_input: train_ground_truth})
-                                train_writer.add_summary(train_summary, i)
-
-                                # Every so often, print out how well the graph is training.
-                                is_last_step = (i + 1 == training_step)
-                                if (i % FLAGS.eval_step_interval) == 0 or is_last_step:
-                                    train_accuracy, cross_entropy_value = sess.run(
-                                        [evaluation_step, cross_entropy],
-                                        feed_dict={bottleneck_input: train_bottlenecks,
-                                                   ground_truth_input: train_ground_truth})
-                                    tf.compat.v1.logging.info('%s: Step %d: Train accuracy = %.2f%%' %
-                                                              (datetime.now(), i, train_accuracy * 100))
-                                    tf.compat.v1.logging.info('%s: Step %d: Cross entropy = %f' %
-                                                              (datetime.now(), i, cross_entropy_value))
-                                    validation_bottlenecks, validation_ground_truth, _ = (
-                                        get_random_cached_bottlenecks(
-                                            sess, image_lists, FLAGS.validation_batch_size, 'validation',
-                                            FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                                            decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                                            model_name))
-                                    # Run a validation step and capture training summaries for TensorBoard
-                                    # with the `merged` op.
-                                    validation_summary, validation_accuracy = sess.run(
-                                        [merged, evaluation_step],
-                                        feed_dict={bottleneck_input: validation_bottlenecks,
-                                                   ground_truth_input: validation_ground_truth})
-                                    validation_writer.add_summary(
-                                        validation_summary, i)
-                                    tf.compat.v1.logging.info('%s: Step %d: Validation accuracy = %.1f%% (N=%d)' %
-                                                              (datetime.now(), i, validation_accuracy * 100,
-                                                               len(validation_bottlenecks)))
-                                    row['train accuracy'] = '{:.2f}'.format(
-                                        train_accuracy * 100)
-                                    row['cross entropy'] = '{:.2f}'.format(
-                                        cross_entropy_value)
-                                    row['validation accuracy'] = '{:.2f}'.format(
-                                        validation_accuracy * 100)
-                                # Store intermediate results
-                                intermediate_frequency = FLAGS.intermediate_store_frequency
-
-                                if (intermediate_frequency > 0 and (i % intermediate_frequency == 0)
-                                        and i > 0):
-                                    intermediate_file_name = (FLAGS.intermediate_output_graphs_dir +
-                                                              'intermediate_' + str(i) + '.pb')
-                                    tf.compat.v1.logging.info('Save intermediate result to : ' +
-                                                              intermediate_file_name)
-                                    save_graph_to_file(
-                                        sess, graph, intermediate_file_name)
-
-                            # We've completed all our training, so run a final test evaluation on
-                            # some new images we haven't used before.
-                            test_bottlenecks, test_ground_truth, test_filenames = (
-                                get_random_cached_bottlenecks(
-                                    sess, image_lists, FLAGS.test_batch_size, 'testing',
-                                    FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                                    decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                                    model_name))
-                            test_accuracy, predictions = sess.run(
-                                [evaluation_step, prediction],
-                                feed_dict={bottleneck_input: test_bottlenecks,
-                                           ground_truth_input: test_ground_truth})
-                            tf.compat.v1.logging.info('Final test accuracy = %.2f%% (N=%d)' %
-                                                      (test_accuracy * 100, len(test_bottlenecks)))
-                            row['final test accuracy'] = '{:.2f}'.format(
-                                test_accuracy * 100)
-
-                            if FLAGS.print_misclassified_test_images:
-                                tf.compat.v1.logging.info(
-                                    '=== MISCLASSIFIED TEST IMAGES ===')
-                                for i, test_filename in enumerate(test_filenames):
-                                    if predictions[i] != test_ground_truth[i].argmax():
-                                        tf.compat.v1.logging.info('%70s  %s' %
-                                                                  (test_filename,
-                                                                   list(image_lists.keys())[predictions[i]]))
-                            end = time.time()
-                            # Write out the trained graph and labels with the weights stored as
-                            # constants.
-                            output_graph = 'tf/tf_files/retrained_graphs/retrained_graph_{}-PT{}-LR{}-TS{}.pb'.format(
-                                model_name, percent_test_validate, learning_rate, training_step)
-                            save_graph_to_file(sess, graph, output_graph)
-                            row['time'] = round(end - start, 2)
-                            row['NO'] = NO
-                            TheWriter.writerow(row)
-                            NO = NO + 1
                 with tf.compat.v1.gfile.GFile(FLAGS.output_labels, 'w') as f:
                     f.write('\n'.join(image_lists.keys()) + '\n')
 
+                # Skip grid points an interrupted sweep already wrote.
+                pending_learning_rates = [
+                    learning_rate for learning_rate in learning_rate_list
+                    if any(sweep_key(model_name, percent_test_validate,
+                                     learning_rate, training_step) not in finished
+                           for training_step in training_step_list)]
+                if not pending_learning_rates:
+                    continue
+                # In-process sweep jobs go on to train in this graph.
+                load_start = time.time()
+                sweep_graph = get_sweep_graph(
+                    model_name, model_info, class_count,
+                    len(pending_learning_rates)
+                    if FLAGS.vectorize_learning_rates else None)
+                load_time = time.time() - load_start
+                tf.compat.v1.logging.info('Loaded base graph of %s in %.2fs',
+                                          model_name, load_time)
+                graph_load_times[model_name] = (
+                    graph_load_times.get(model_name, 0) + load_time)
+                cache_sweep_bottlenecks(sweep_graph, model_name, image_lists,
+                                        cached_categories)
+                if FLAGS.vectorize_learning_rates:
+                    jobs.append((model_name, image_lists, percent_test_validate,
+                                 pending_learning_rates))
+                else:
+                    for learning_rate in pending_learning_rates:
+                        jobs.append((model_name, image_lists, percent_test_validate,
+                                     [learning_rate]))
+        tf.compat.v1.logging.info('%d sweep jobs to run, %d rows already in tests.csv',
+                                  len(jobs), len(finished))
+
+        if FLAGS.sweep_parallelism <= 1:
+            for job in jobs:
+                rows = run_sweep_job(FLAGS, *job,
+                                     training_step_list=training_step_list)
+                if rows:
+                    # The jobs reuse the graph main() loaded, so its cost is
+                    # charged to the first row of the architecture.
+                    rows[0]['load time'] = round(
+                        rows[0]['load time'] +
+                        graph_load_times.pop(job[0], 0), 2)
+                NO = write_results(csv_file, fieldnames, rows, finished, NO)
+            close_sweep_graphs()
+            return
+
+        # Workers load their own graphs.
+        close_sweep_graphs()
+
+        # TF is not fork safe, so workers are spawned and split the cores.
+        intra_op_threads = max(
+            1, multiprocessing.cpu_count() // FLAGS.sweep_parallelism)
+        with ProcessPoolExecutor(
+                FLAGS.sweep_parallelism,
+                mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = dict(
+                (pool.submit(run_sweep_job, FLAGS, *job,
+                             training_step_list=training_step_list,
+                             intra_op_threads=intra_op_threads), job)
+                for job in jobs)
+            for future in as_completed(futures):
+                model_name, _, percent_test_validate, learning_rates = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    tf.compat.v1.logging.error(
+                        'Sweep job %s-PT%s-LR%s failed: %s', model_name,
+                        percent_test_validate, learning_rates, e)
+                    continue
+                NO = write_results(csv_file, fieldnames, rows, finished, NO)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -822,6 +1185,16 @@ if __name__ == '__main__':
         default=10,
         help='How often to evaluate the training results.'
     )
+    parser.add_argument(
+        '--summary_interval',
+        type=int,
+        default=0,
+        help="""\
+        How often to write the scalar training summaries between evaluations.
+        Histograms are only computed with an evaluation, every
+        --eval_step_interval steps. If "0", steps in between only train.\
+        """
+    )
     parser.add_argument(
         '--train_batch_size',
         type=int,
@@ -860,6 +1233,42 @@ if __name__ == '__main__':
       """,
         action='store_true'
     )
+    parser.add_argument(
+        '--sweep_parallelism',
+        type=int,
+        default=1,
+        help="""\
+      How many grid points to train at once, each in its own process. Rows
+      already in tests.csv are skipped, so an interrupted sweep resumes.\
+      """
+    )
+    parser.add_argument(
+        '--vectorize_learning_rates',
+        default=False,
+        help="""\
+      Train the final layers of all learning rates side by side in one graph,
+      sharing every bottleneck batch, instead of one run per learning rate.\
+      """,
+        action='store_true'
+    )
+    parser.add_argument(
+        '--random_seed',
+        type=int,
+        default=None,
+        help="""\
+      Seed for weight initialization and batch sampling. With a seed, every
+      snapshot matches a run trained from scratch to the same step count.\
+      """
+    )
+    parser.add_argument(
+        '--train_from_scratch_per_step',
+        default=False,
+        help="""\
+      Retrain from freshly initialized weights for every training step count
+      instead of training once and snapshotting each count on the way.\
+      """,
+        action='store_true'
+    )
     parser.add_argument(
         '--model_dir',
         type=str,
@@ -876,6 +1285,15 @@ if __name__ == '__main__':
         default='tf/tf_files/bottlenecks',
         help='Path to cache bottleneck layer values as files.'
     )
+    parser.add_argument(
+        '--bottleneck_batch_size',
+        type=int,
+        default=32,
+        help="""\
+      How many images to run through the base network at once while caching
+      bottlenecks. Graphs built for a single image fall back to 1.\
+      """
+    )
     parser.add_argument(
         '--final_tensor_name',
         type=str,
@@ -9,15 +9,21 @@ import os
 import re
 import csv
 
-import numpy as np
 import tensorflow as tf
 from tensorflow.python.platform import gfile
 import collections
 
+from tf.tf_scripts.evaluation import EvaluationEngine
+from tf.tf_scripts.evaluation import decode_test_images
+from tf.tf_scripts.evaluation import final_layer
+from tf.tf_scripts.evaluation import score_bottlenecks
+from tf.tf_scripts.evaluation import summarize_scores
+from tf.tf_scripts.preprocess import ImagePreprocessor
+
 
 def create_image_lists(image_dir):
     if not tf.compat.v1.gfile.Exists(image_dir):
-        tf.logging.error("Image directory '" + image_dir + "' not found.")
+        tf.compat.v1.logging.error("Image directory '" + image_dir + "' not found.")
         return None
     result = collections.OrderedDict()
     sub_dirs = [
@@ -31,12 +37,12 @@ def create_image_lists(image_dir):
         dir_name = os.path.basename(sub_dir)
         if dir_name == image_dir:
             continue
-        tf.logging.info("Looking for images in '" + dir_name + "'")
+        tf.compat.v1.logging.info("Looking for images in '" + dir_name + "'")
         for extension in extensions:
             file_glob = os.path.join(image_dir, dir_name, '*.' + extension)
             file_list.extend(gfile.Glob(file_glob))
         if not file_list:
-            tf.logging.warning('No files found')
+            tf.compat.v1.logging.warning('No files found')
             continue
         label_name = re.sub(r'[^a-z0-9]+', ' ', dir_name.lower())
         result[label_name] = {
@@ -46,42 +52,21 @@ def create_image_lists(image_dir):
     return result
 
 
-def load_graph(model_file):
-    graph = tf.Graph()
-    graph_def = tf.GraphDef()
-
+def load_graph_def(model_file):
+    graph_def = tf.compat.v1.GraphDef()
     with open(model_file, "rb") as f:
         graph_def.ParseFromString(f.read())
-    with graph.as_default():
-        tf.import_graph_def(graph_def)
+    return graph_def
 
-    return graph
 
+def load_graph(model_file):
+    graph = tf.Graph()
+    graph_def = load_graph_def(model_file)
 
-def read_tensor_from_image_file(file_name, input_height=299, input_width=299, input_mean=0, input_std=255):
-    input_name = "file_reader"
-    # output_name = "normalized"
-    file_reader = tf.read_file(file_name, input_name)
-    if file_name.endswith(".png"):
-        image_reader = tf.image.decode_png(file_reader, channels=3,
-                                           name='png_reader')
-    elif file_name.endswith(".gif"):
-        image_reader = tf.squeeze(tf.image.decode_gif(file_reader,
-                                                      name='gif_reader'))
-    elif file_name.endswith(".bmp"):
-        image_reader = tf.image.decode_bmp(file_reader, name='bmp_reader')
-    else:
-        image_reader = tf.image.decode_jpeg(file_reader, channels=3,
-                                            name='jpeg_reader')
-    float_caster = tf.cast(image_reader, tf.float32)
-    dims_expander = tf.expand_dims(float_caster, 0)
-    resized = tf.image.resize_bilinear(
-        dims_expander, [input_height, input_width])
-    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
-    sess = tf.Session()
-    result = sess.run(normalized)
+    with graph.as_default():
+        tf.compat.v1.import_graph_def(graph_def)
 
-    return result
+    return graph
 
 
 def load_labels(label_file):
@@ -163,6 +148,38 @@ if __name__ == "__main__":
         default="final_result",
         help="name of output layer"
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="images run through each graph at once"
+    )
+    parser.add_argument(
+        "--preprocess_threads",
+        type=int,
+        default=0,
+        help="threads decoding the test images, 0 for one per core"
+    )
+    parser.add_argument(
+        "--decoded_cache_dir",
+        type=str,
+        default="",
+        help="""\
+      Where to keep the decoded test images of each input resolution as .npy
+      files, reused by later runs until an image changes. If empty, they are
+      decoded once per run and kept in memory.\
+      """
+    )
+    parser.add_argument(
+        "--shared_features",
+        action="store_true",
+        help="""\
+      Run the base network on the test images once per architecture and
+      score every variant with its final layer weights in NumPy. Only valid
+      when all variants of an architecture were retrained from the same base
+      model.\
+      """
+    )
     args = parser.parse_args()
 
     if args.graph_dir:
@@ -202,6 +219,17 @@ if __name__ == "__main__":
     training_step_list = ['100', '200', '300', '400',
                           '500', '600', '700', '800', '900', '1000']
     testing_percentage_list = ['10', '20', '30']
+    labels = load_labels(label_file)
+    # Every test image is decoded once per input resolution, and each of the
+    # model variants at that resolution is scored on the same array.
+    decoded_images = {}
+    for size in set(input_WidthAndHeight.values()):
+        with ImagePreprocessor(input_height=size, input_width=size,
+                               input_mean=input_mean,
+                               input_std=input_std) as preprocessor:
+            decoded_images[size] = decode_test_images(
+                label_results, preprocessor, args.decoded_cache_dir,
+                args.preprocess_threads)
     NO = 1
     with open("tests.csv", "w", newline="") as f:
         fieldnames = ['NO', 'model name', 'percent test', 'learning rate', 'training step', 'basil leaf', 'chili leaf',
@@ -209,45 +237,39 @@ if __name__ == "__main__":
         TheWriter = csv.DictWriter(f, fieldnames=fieldnames)
         TheWriter.writeheader()
         for model_name in model_name_list:
+            bottlenecks = None
             for percent_test in testing_percentage_list:
                 for learning_rate in learning_rate_list:
                     for training_step in training_step_list:
                         model_file = "{}/retrained_graph_{}-PT{}-LR{}-TS{}.pb".format(
                             model_dir, model_name, percent_test, learning_rate, training_step)
-                        graph = load_graph(model_file)
                         input_name = "import/" + input_layers[model_name]
                         output_name = "import/" + output_layer
-                        input_operation = graph.get_operation_by_name(
-                            input_name)
-                        output_operation = graph.get_operation_by_name(
-                            output_name)
+                        images = decoded_images[input_WidthAndHeight[model_name]]
 
-                        sumary = {}
                         start = time.time()
-
-                        for label_name, label_lists in label_results.items():
-                            sumary[label_name] = {
-                                "list_score": []
-                            }
-                            sum_score = 0
-                            for index, img in enumerate(label_lists["test"]):
-                                t = read_tensor_from_image_file(img,
-                                                                input_height=input_WidthAndHeight[model_name],
-                                                                input_width=input_WidthAndHeight[model_name],
-                                                                input_mean=input_mean,
-                                                                input_std=input_std)
-                                with tf.Session(graph=graph) as sess:
-                                    results = sess.run(output_operation.outputs[0], {
-                                        input_operation.outputs[0]: t})
-                                results = np.squeeze(results)
-                                labels = load_labels(label_file)
-                                labels_idx = dict([(value, idx)
-                                                   for idx, value in enumerate(labels)])
-                                score = results[labels_idx[label_name]]
-                                sum_score += score
-                                sumary[label_name]["list_score"].append(score)
-                            sumary[label_name]["average"] = sum_score / \
-                                len(sumary[label_name]["list_score"])
+                        if args.shared_features:
+                            bottleneck_name, weights, biases = final_layer(
+                                load_graph_def(model_file))
+                            if bottlenecks is None:
+                                # The first variant's base network computes the
+                                # bottlenecks that every variant is scored on.
+                                with EvaluationEngine(load_graph(model_file), input_name,
+                                                      "import/" + bottleneck_name, labels,
+                                                      args.batch_size) as engine:
+                                    bottlenecks = engine.run_images(images)
+                                    label_names, classes, label_indices = (
+                                        engine.label_indices(label_results))
+                            sumary = summarize_scores(
+                                label_names, classes,
+                                score_bottlenecks(bottlenecks, weights, biases,
+                                                  label_indices))
+                        else:
+                            with EvaluationEngine(load_graph(model_file), input_name,
+                                                  output_name, labels,
+                                                  args.batch_size) as engine:
+                                sumary, _ = engine.evaluate(label_results,
+                                                            images=images)
                         end = time.time()
                         # print(" >>> Test accuracy images <<<")
                         # print("use time {}".format(end - start))
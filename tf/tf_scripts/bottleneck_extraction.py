@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+
+def supported_batch_size(resized_input_tensor, bottleneck_tensor,
+                         batch_size):
+    """`batch_size`, or 1 if the base graph is built for single images.
+
+    Graphs such as the classic Inception v3 export fix the batch dimension of
+    their input or bottleneck to 1, and cannot be fed a stacked batch.
+    """
+    for tensor in (resized_input_tensor, bottleneck_tensor):
+        if tensor.shape.rank and tensor.shape.as_list()[0] == 1:
+            return 1
+    return max(batch_size, 1)
+
+
+def extract_bottlenecks(sess, jobs, bottleneck_store, image_data_tensor,
+                        decoded_image_tensor, resized_input_tensor,
+                        bottleneck_tensor, batch_size=32, decode_threads=None):
+    """Compute the bottleneck of every (key, image_path) in `jobs`.
+
+    Images are read, decoded and resized on `decode_threads` threads that
+    work ahead of the base network, which consumes them in order
+    `batch_size` at a time. Each batch is written to `bottleneck_store`
+    with one put_many.
+    """
+    if not jobs:
+        return
+    requested_batch_size = batch_size
+    batch_size = supported_batch_size(resized_input_tensor, bottleneck_tensor,
+                                      batch_size)
+    if batch_size < requested_batch_size:
+        tf.compat.v1.logging.info(
+            'Base graph takes one image at a time, extracting bottlenecks '
+            'with batch size 1')
+
+    def decode(job):
+        image_path = job[1]
+        if not tf.compat.v1.gfile.Exists(image_path):
+            tf.compat.v1.logging.fatal('File does not exist %s', image_path)
+        image_data = tf.compat.v1.gfile.GFile(image_path, 'rb').read()
+        try:
+            return sess.run(decoded_image_tensor,
+                            {image_data_tensor: image_data})
+        except Exception as e:
+            raise RuntimeError('Error during processing file %s (%s)' %
+                               (image_path, str(e)))
+
+    # Decoders run ahead of the base network by up to two batches, so the
+    # next batch is being decoded while the current one is in sess.run.
+    decode_threads = decode_threads or multiprocessing.cpu_count()
+    max_pending = 2 * batch_size + decode_threads
+    pending = collections.deque()
+    remaining = iter(jobs)
+    start = time.time()
+    done = 0
+    with ThreadPoolExecutor(decode_threads) as pool:
+
+        def fill():
+            while len(pending) < max_pending:
+                job = next(remaining, None)
+                if job is None:
+                    return
+                pending.append((job[0], pool.submit(decode, job)))
+
+        fill()
+        while pending:
+            batch = [pending.popleft()
+                     for _ in range(min(batch_size, len(pending)))]
+            resized_input_values = np.concatenate(
+                [future.result() for _, future in batch])
+            fill()
+            bottleneck_values = sess.run(
+                bottleneck_tensor,
+                {resized_input_tensor: resized_input_values})
+            bottleneck_store.put_many(
+                [key for key, _ in batch],
+                np.reshape(bottleneck_values, (len(batch), -1)))
+            done += len(batch)
+            if done % 100 < len(batch) or done == len(jobs):
+                tf.compat.v1.logging.info(
+                    '%d/%d bottlenecks created, %.1f images/sec', done,
+                    len(jobs), done / (time.time() - start))
@@ -0,0 +1,287 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+class BottleneckStore(object):
+    """Binary bottleneck cache, one float32 row per distinct image content.
+
+    All bottlenecks of one architecture live in a single flat float32 file
+    that is read through a memory map, and a JSON index maps the SHA-1 of
+    every image's bytes to its row. A manifest in the same index remembers
+    the mtime, size and hash of every image path, so an unchanged image is
+    not re-hashed, an overwritten one gets a fresh bottleneck and a renamed
+    or moved one reuses its row.
+
+    Rows are appended as they are created; the index is rewritten atomically
+    by `flush()`, and rows written after the last flush are dropped when the
+    store is opened again.
+    """
+
+    def __init__(self, bottleneck_dir, architecture, flush_every=100):
+        self.bottleneck_dir = bottleneck_dir
+        self.architecture = architecture
+        self.index_path = os.path.join(bottleneck_dir,
+                                       architecture + '.index.json')
+        self.flush_every = flush_every
+        self.bottleneck_size = None
+        self.generation = 0
+        self.index = {}
+        self.files = {}
+        self._unflushed = 0
+        self._matrix = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+            self.bottleneck_size = saved['bottleneck_size']
+            self.generation = saved.get('generation', 0)
+            self.index = saved['rows']
+            self.files = saved.get('files', {})
+        self.data_path = self._data_path()
+        self.row_count = max(self.index.values()) + 1 if self.index else 0
+        if os.path.exists(self.data_path):
+            expected_size = self.row_count * self._row_bytes()
+            if os.path.getsize(self.data_path) != expected_size:
+                with open(self.data_path, 'r+b') as f:
+                    f.truncate(expected_size)
+
+    def _data_path(self):
+        suffix = '.%d' % self.generation if self.generation else ''
+        return os.path.join(self.bottleneck_dir,
+                            self.architecture + suffix + '.bottlenecks')
+
+    def _row_bytes(self):
+        return (self.bottleneck_size or 0) * np.dtype(np.float32).itemsize
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def image_hash(self, image_key, image_path):
+        """Content hash of an image, re-read only if its mtime or size moved."""
+        stat = os.stat(image_path)
+        entry = self.files.get(image_key)
+        if (entry is not None and entry['mtime'] == stat.st_mtime and
+                entry['size'] == stat.st_size):
+            return entry['hash']
+        with open(image_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self.files[image_key] = {'mtime': stat.st_mtime,
+                                 'size': stat.st_size,
+                                 'hash': digest}
+        self._unflushed += 1
+        return digest
+
+    def matrix(self):
+        """Read-only [rows, bottleneck_size] view of the whole store."""
+        if self._matrix is None or self._matrix.shape[0] != self.row_count:
+            if self.row_count == 0:
+                return np.zeros((0, self.bottleneck_size or 0), np.float32)
+            self._matrix = np.memmap(self.data_path, dtype=np.float32,
+                                     mode='r',
+                                     shape=(self.row_count,
+                                            self.bottleneck_size))
+        return self._matrix
+
+    def get(self, key):
+        return np.array(self.matrix()[self.index[key]])
+
+    def get_many(self, keys):
+        return self.matrix()[[self.index[key] for key in keys]]
+
+    def image_rows(self, image_keys):
+        """Rows of images already hashed by `image_hash`."""
+        return [self.index[self.files[key]['hash']] for key in image_keys]
+
+    def get_images(self, image_keys):
+        return self.matrix()[self.image_rows(image_keys)]
+
+    def put(self, key, values):
+        self.put_many([key], [values])
+
+    def put_many(self, keys, values):
+        values = np.asarray(values, dtype=np.float32).reshape(len(keys), -1)
+        if self.bottleneck_size is None:
+            self.bottleneck_size = values.shape[1]
+        elif values.shape[1] != self.bottleneck_size:
+            raise ValueError('Bottleneck size %d does not match store size %d'
+                             % (values.shape[1], self.bottleneck_size))
+        mode = 'r+b' if os.path.exists(self.data_path) else 'wb'
+        with open(self.data_path, mode) as f:
+            for key, row in zip(keys, values):
+                if key not in self.index:
+                    self.index[key] = self.row_count
+                    self.row_count += 1
+                f.seek(self.index[key] * self._row_bytes())
+                f.write(row.tobytes())
+        self._unflushed += len(keys)
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def collect_garbage(self, image_keys):
+        """Forget images not in `image_keys` and drop rows no image uses.
+
+        Live rows are copied to a new data file that the index switches to
+        atomically, so a crash leaves either the old or the new store.
+        Returns the number of rows dropped.
+        """
+        image_keys = set(image_keys)
+        for image_key in list(self.files):
+            if image_key not in image_keys:
+                del self.files[image_key]
+                self._unflushed += 1
+        live = set(entry['hash'] for entry in self.files.values())
+        keep = [key for key in sorted(self.index, key=self.index.get)
+                if key.split(':')[0] in live]
+        dropped = len(self.index) - len(keep)
+        if not dropped:
+            return 0
+        matrix = self.matrix()
+        old_path = self.data_path
+        self.generation += 1
+        self.data_path = self._data_path()
+        with open(self.data_path, 'wb') as f:
+            for begin in range(0, len(keep), 1024):
+                f.write(np.ascontiguousarray(matrix[[
+                    self.index[key] for key in keep[begin:begin + 1024]
+                ]]).tobytes())
+        self._matrix = None
+        self.index = dict((key, row) for row, key in enumerate(keep))
+        self.row_count = len(keep)
+        self._unflushed += 1
+        self.flush()
+        del matrix
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        return dropped
+
+    def flush(self):
+        if not self._unflushed:
+            return
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'bottleneck_size': self.bottleneck_size,
+                       'generation': self.generation,
+                       'rows': self.index,
+                       'files': self.files}, f)
+        os.replace(tmp_path, self.index_path)
+        self._unflushed = 0
+
+
+def augmented_key(image_hash, variant):
+    """Store key of one distorted variant of the image with `image_hash`."""
+    return '%s:%d' % (image_hash, variant)
+
+
+class CachedBottlenecks(object):
+    """Every bottleneck of one category loaded into RAM with its label.
+
+    Batches are drawn with NumPy indexing the same way the per-file sampling
+    did: a random class first, then a random image of that class.
+
+    With `in_memory=False` the rows are read from the store's memory map on
+    every batch instead, so processes sampling from the same store share one
+    copy of the bottlenecks through the page cache.
+
+    With `variants`, the store holds that many distorted variants of every
+    image under `augmented_key`, and each sample picks one of them at random.
+    """
+
+    def __init__(self, bottleneck_store, image_lists, category, image_dir,
+                 seed=None, in_memory=True, variants=None):
+        keys = []
+        label_indices = []
+        for label_index, label_lists in enumerate(image_lists.values()):
+            for base_name in label_lists[category]:
+                keys.append(os.path.join(label_lists['dir'], base_name))
+                label_indices.append(label_index)
+        class_count = len(image_lists)
+        self.category = category
+        self.filenames = [os.path.join(image_dir, key) for key in keys]
+        if variants:
+            store_rows = [
+                bottleneck_store.index[augmented_key(
+                    bottleneck_store.files[key]['hash'], variant)]
+                for key in keys for variant in range(variants)]
+        else:
+            store_rows = bottleneck_store.image_rows(keys)
+        # One row of store rows per image, one column per variant.
+        store_rows = np.array(store_rows, dtype=np.int64).reshape(
+            len(keys), variants or 1)
+        if in_memory:
+            self.bottlenecks = np.ascontiguousarray(
+                bottleneck_store.matrix()[store_rows.ravel()])
+            self._rows = np.arange(store_rows.size).reshape(store_rows.shape)
+        else:
+            self.bottlenecks = bottleneck_store.matrix()
+            self._rows = store_rows
+        self.label_indices = np.array(label_indices, dtype=np.int64)
+        self.ground_truth = np.eye(
+            class_count, dtype=np.float32)[self.label_indices]
+        class_sizes = np.bincount(self.label_indices, minlength=class_count)
+        self._classes = np.flatnonzero(class_sizes)
+        self._class_offsets = (np.cumsum(class_sizes) -
+                               class_sizes)[self._classes]
+        self._class_sizes = class_sizes[self._classes]
+        self.random_state = np.random.RandomState(seed)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def sample(self, how_many, random_state=None):
+        """(bottlenecks, ground_truth, filenames) of a batch, all if < 0."""
+        variants = self._rows.shape[1]
+        if how_many < 0:
+            return (self.bottlenecks[self._rows.ravel()],
+                    np.repeat(self.ground_truth, variants, axis=0),
+                    [filename for filename in self.filenames
+                     for _ in range(variants)])
+        if not len(self._classes):
+            tf.compat.v1.logging.fatal('Category has no images - %s.',
+                                       self.category)
+        random_state = random_state or self.random_state
+        classes = random_state.randint(len(self._classes), size=how_many)
+        rows = (self._class_offsets[classes] +
+                random_state.randint(self._class_sizes[classes]))
+        if variants > 1:
+            columns = random_state.randint(variants, size=how_many)
+        else:
+            columns = 0
+        return (self.bottlenecks[self._rows[rows, columns]],
+                self.ground_truth[rows],
+                [self.filenames[row] for row in rows])
+
+
+_bottleneck_stores = {}
+
+
+def get_bottleneck_store(bottleneck_dir, architecture):
+    """Open store for `architecture`, shared by every caller in the process."""
+    key = (os.path.abspath(bottleneck_dir), architecture)
+    if key not in _bottleneck_stores:
+        if not os.path.exists(bottleneck_dir):
+            os.makedirs(bottleneck_dir)
+        _bottleneck_stores[key] = BottleneckStore(bottleneck_dir,
+                                                  architecture)
+    return _bottleneck_stores[key]
+
+
+def read_text_bottleneck(bottleneck_path):
+    """Values of a legacy comma separated bottleneck file, None if corrupt."""
+    with open(bottleneck_path, 'r') as bottleneck_file:
+        bottleneck_string = bottleneck_file.read()
+    try:
+        return [float(x) for x in bottleneck_string.split(',')]
+    except ValueError:
+        tf.compat.v1.logging.warning(
+            'Invalid float found in %s', bottleneck_path)
+        return None
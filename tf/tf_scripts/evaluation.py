@@ -0,0 +1,218 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from tf.tf_scripts.bottleneck_extraction import supported_batch_size
+
+
+def preprocess_ahead(preprocess, items, threads, window):
+    """Yield `preprocess(item)` in order, computed up to `window` items ahead."""
+    pending = collections.deque()
+    with ThreadPoolExecutor(threads) as pool:
+        for item in items:
+            pending.append(pool.submit(preprocess, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def test_files(label_results):
+    """Every test image path of `label_results` with its label, in order."""
+    return [(file_name, label_name)
+            for label_name, label_lists in label_results.items()
+            for file_name in label_lists['test']]
+
+
+def decode_test_images(label_results, preprocessor, cache_dir=None,
+                       threads=None):
+    """[images, h, w, 3] array of every test image run through `preprocessor`.
+
+    Rows follow the order EvaluationEngine.evaluate uses. With `cache_dir`
+    the array is saved as a .npy file named after the preprocessing settings
+    and the path, mtime and size of every image, and memory-mapped by later
+    calls until an image changes.
+    """
+    file_names = [file_name for file_name, _ in test_files(label_results)]
+    shape = (len(file_names), preprocessor.input_height,
+             preprocessor.input_width, 3)
+    threads = threads or multiprocessing.cpu_count()
+    cache_path = None
+    if cache_dir:
+        signature = [preprocessor.input_height, preprocessor.input_width,
+                     preprocessor.input_mean, preprocessor.input_std]
+        for file_name in file_names:
+            stat = os.stat(file_name)
+            signature.append([file_name, stat.st_mtime, stat.st_size])
+        cache_path = os.path.join(cache_dir, 'test_images_%dx%d_%s.npy' % (
+            shape[1], shape[2], hashlib.sha1(
+                json.dumps(signature).encode('utf-8')).hexdigest()[:10]))
+        if os.path.exists(cache_path):
+            return np.load(cache_path, mmap_mode='r')
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_path = cache_path + '.tmp.npy'
+        images = np.lib.format.open_memmap(tmp_path, mode='w+',
+                                           dtype=np.float32, shape=shape)
+    else:
+        images = np.zeros(shape, dtype=np.float32)
+    start = time.time()
+    decoded = preprocess_ahead(preprocessor.run_file, file_names, threads,
+                               4 * threads)
+    for index, image in enumerate(decoded):
+        images[index] = image[0]
+    tf.compat.v1.logging.info('Decoded %d test images at %dx%d, %.1f images/sec',
+                              len(file_names), shape[1], shape[2],
+                              len(file_names) / max(time.time() - start, 1e-6))
+    if cache_path is None:
+        return images
+    images.flush()
+    del images
+    os.replace(tmp_path, cache_path)
+    return np.load(cache_path, mmap_mode='r')
+
+
+def final_layer(graph_def):
+    """(bottleneck input name, weights, biases) of a retrained GraphDef.
+
+    Graphs exported by retrain.py and auto_retrain.py freeze the trained
+    layer into the final_weights and final_biases constants, applied as
+    softmax(bottleneck . weights + biases).
+    """
+    nodes = dict((node.name, node) for node in graph_def.node)
+    weights = tf.compat.v1.make_ndarray(
+        nodes['final_training_ops/weights/final_weights'].attr['value'].tensor)
+    biases = tf.compat.v1.make_ndarray(
+        nodes['final_training_ops/biases/final_biases'].attr['value'].tensor)
+    bottleneck_name = nodes['final_training_ops/Wx_plus_b/MatMul'].input[0]
+    return bottleneck_name.split(':')[0], weights, biases
+
+
+def score_bottlenecks(bottlenecks, weights, biases, label_indices):
+    """Softmax score of `label_indices[i]` for the final layer on row i."""
+    logits = np.dot(bottlenecks, weights) + biases
+    logits -= logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    return probabilities[np.arange(len(label_indices)), label_indices]
+
+
+def summarize_scores(label_names, classes, scores):
+    """{label: {'list_score', 'average'}} of per-image `scores`."""
+    sums = np.bincount(classes, weights=scores, minlength=len(label_names))
+    counts = np.bincount(classes, minlength=len(label_names))
+    summary = collections.OrderedDict()
+    for class_index, label_name in enumerate(label_names):
+        summary[label_name] = {
+            "list_score": scores[classes == class_index],
+            "average": sums[class_index] / max(counts[class_index], 1)
+        }
+    return summary
+
+
+class EvaluationEngine(object):
+    """Scores a retrained graph on folders of labelled test images.
+
+    The graph gets one session for its lifetime. Images are preprocessed on
+    `preprocess_threads` threads ahead of inference, which runs
+    `batch_size` images at a time, or one at a time for graphs built for a
+    single image. The score of every image's true label is kept in NumPy
+    arrays and averaged per class.
+    """
+
+    def __init__(self, graph, input_name, output_name, labels, batch_size=32,
+                 preprocess_threads=None):
+        self.graph = graph
+        self.input_tensor = graph.get_operation_by_name(input_name).outputs[0]
+        self.output_tensor = graph.get_operation_by_name(
+            output_name).outputs[0]
+        self.labels_idx = dict((value, idx)
+                               for idx, value in enumerate(labels))
+        self.batch_size = supported_batch_size(self.input_tensor,
+                                               self.output_tensor, batch_size)
+        self.preprocess_threads = (preprocess_threads or
+                                   multiprocessing.cpu_count())
+        self.session = tf.compat.v1.Session(graph=graph)
+
+    def _batches(self, images):
+        batch = []
+        for image in images:
+            batch.append(image)
+            if len(batch) == self.batch_size:
+                yield np.concatenate(batch)
+                batch = []
+        if batch:
+            yield np.concatenate(batch)
+
+    def run_images(self, images):
+        """[images, outputs] array of the output tensor on every image.
+
+        `images` is either an [images, h, w, 3] array, as returned by
+        decode_test_images, or an iterable of [1, h, w, 3] images.
+        """
+        if isinstance(images, np.ndarray):
+            batches = (images[begin:begin + self.batch_size]
+                       for begin in range(0, len(images), self.batch_size))
+        else:
+            batches = self._batches(images)
+        results = [
+            np.reshape(self.session.run(self.output_tensor,
+                                        {self.input_tensor: batch}),
+                       (len(batch), -1))
+            for batch in batches]
+        if not results:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(results)
+
+    def label_indices(self, label_results):
+        """(label names, class of each test image, its index in the labels)."""
+        label_names = list(label_results.keys())
+        files = test_files(label_results)
+        class_indices = dict((label_name, class_index) for class_index,
+                             label_name in enumerate(label_names))
+        classes = np.array([class_indices[label_name]
+                            for _, label_name in files], dtype=np.int64)
+        label_indices = np.array([self.labels_idx[label_name]
+                                  for _, label_name in files], dtype=np.int64)
+        return label_names, classes, label_indices
+
+    def evaluate(self, label_results, preprocessor=None, images=None):
+        """Average score per class of the images in `label_results`.
+
+        `label_results` maps a label to {'test': [image paths]}, as built by
+        create_image_lists. The images are read and run through
+        `preprocessor`, unless `images` from decode_test_images already holds
+        them. Returns ({label: {'list_score', 'average'}}, images/sec).
+        """
+        label_names, classes, label_indices = self.label_indices(label_results)
+        start = time.time()
+        if images is None:
+            images = preprocess_ahead(
+                preprocessor.run_file,
+                [file_name for file_name, _ in test_files(label_results)],
+                self.preprocess_threads,
+                2 * self.batch_size + self.preprocess_threads)
+        results = self.run_images(images)
+        scores = results[np.arange(len(label_indices)), label_indices]
+        images_per_sec = len(label_indices) / max(time.time() - start, 1e-6)
+        return summarize_scores(label_names, classes, scores), images_per_sec
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
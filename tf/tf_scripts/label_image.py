@@ -9,6 +9,8 @@ import time
 import numpy as np
 import tensorflow as tf
 
+from tf.tf_scripts.preprocess import ImagePreprocessor
+
 
 def load_graph(model_file):
     graph = tf.Graph()
@@ -22,32 +24,6 @@ def load_graph(model_file):
     return graph
 
 
-def read_tensor_from_image_file(file_name, input_height=299, input_width=299, input_mean=0, input_std=255):
-    input_name = "file_reader"
-    # output_name = "normalized"
-    file_reader = tf.read_file(file_name, input_name)
-    if file_name.endswith(".png"):
-        image_reader = tf.image.decode_png(file_reader, channels=3,
-                                           name='png_reader')
-    elif file_name.endswith(".gif"):
-        image_reader = tf.squeeze(tf.image.decode_gif(file_reader,
-                                                      name='gif_reader'))
-    elif file_name.endswith(".bmp"):
-        image_reader = tf.image.decode_bmp(file_reader, name='bmp_reader')
-    else:
-        image_reader = tf.image.decode_jpeg(file_reader, channels=3,
-                                            name='jpeg_reader')
-    float_caster = tf.cast(image_reader, tf.float32)
-    dims_expander = tf.expand_dims(float_caster, 0)
-    resized = tf.image.resize_bilinear(
-        dims_expander, [input_height, input_width])
-    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
-    sess = tf.Session()
-    result = sess.run(normalized)
-
-    return result
-
-
 def load_labels(label_file):
     label = []
     proto_as_ascii_lines = tf.gfile.GFile(label_file).readlines()
@@ -99,11 +75,11 @@ if __name__ == "__main__":
         output_layer = args.output_layer
 
     graph = load_graph(model_file)
-    t = read_tensor_from_image_file(file_name,
-                                    input_height=input_height,
-                                    input_width=input_width,
-                                    input_mean=input_mean,
-                                    input_std=input_std)
+    with ImagePreprocessor(input_height=input_height,
+                           input_width=input_width,
+                           input_mean=input_mean,
+                           input_std=input_std) as preprocessor:
+        t = preprocessor.run_file(file_name)
 
     input_name = "import/" + input_layer
     output_name = "import/" + output_layer
@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+def add_image_decoding(image_data, input_height, input_width, input_mean,
+                       input_std):
+    """Decode an encoded image string into a normalized [1, h, w, 3] batch."""
+    image_reader = tf.image.decode_image(image_data, channels=3)
+    # GIFs decode to [frames, height, width, 3], keep the first frame only.
+    image_4d = tf.cond(tf.equal(tf.rank(image_reader), 4),
+                       lambda: image_reader[:1],
+                       lambda: tf.expand_dims(image_reader, 0))
+    image_4d.set_shape([1, None, None, 3])
+    float_caster = tf.cast(image_4d, tf.float32)
+    resized = tf.compat.v1.image.resize_bilinear(
+        float_caster, [input_height, input_width])
+    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
+    return normalized
+
+
+class ImagePreprocessor(object):
+    """Decode/resize/normalize subgraph built once and reused for every image.
+
+    The graph is finalized after construction, so repeated calls can never add
+    ops to it, and all calls share one session.
+    """
+
+    def __init__(self, input_height=224, input_width=224, input_mean=0,
+                 input_std=255):
+        self.input_height = input_height
+        self.input_width = input_width
+        self.input_mean = input_mean
+        self.input_std = input_std
+        self.graph = tf.compat.v1.Graph()
+        with self.graph.as_default():
+            self.image_data = tf.compat.v1.placeholder(
+                tf.string, name='image_data')
+            self.normalized = add_image_decoding(
+                self.image_data, input_height, input_width, input_mean,
+                input_std)
+        self.graph.finalize()
+        self.session = tf.compat.v1.Session(graph=self.graph)
+
+    def run(self, image_data):
+        return self.session.run(self.normalized,
+                                {self.image_data: image_data})
+
+    def run_file(self, file_name):
+        with tf.compat.v1.gfile.GFile(file_name, 'rb') as f:
+            return self.run(f.read())
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -6,16 +6,24 @@ import argparse
 import collections
 from datetime import datetime
 import hashlib
+import json
 import os.path
-import random
 import re
 import sys
 import tarfile
+import time
 
 import numpy as np
 from six.moves import urllib
 import tensorflow as tf
 
+from tf.tf_scripts.bottleneck_extraction import extract_bottlenecks
+from tf.tf_scripts.bottleneck_extraction import supported_batch_size
+from tf.tf_scripts.bottleneck_store import CachedBottlenecks
+from tf.tf_scripts.bottleneck_store import augmented_key
+from tf.tf_scripts.bottleneck_store import get_bottleneck_store
+from tf.tf_scripts.bottleneck_store import read_text_bottleneck
+
 FLAGS = None
 
 # These are all parameters that are tied to the particular model architecture
@@ -123,19 +131,6 @@ def create_model_graph(model_info):
     return graph, bottleneck_tensor, resized_input_tensor
 
 
-def run_bottleneck_on_image(sess, image_data, image_data_tensor,
-                            decoded_image_tensor, resized_input_tensor,
-                            bottleneck_tensor):
-    # First decode the JPEG image, resize it, and rescale the pixel values.
-    resized_input_values = sess.run(decoded_image_tensor,
-                                    {image_data_tensor: image_data})
-    # Then run it through the recognition network.
-    bottleneck_values = sess.run(bottleneck_tensor,
-                                 {resized_input_tensor: resized_input_values})
-    bottleneck_values = np.squeeze(bottleneck_values)
-    return bottleneck_values
-
-
 def maybe_download_and_extract(data_url):
     dest_directory = FLAGS.model_dir
     if not os.path.exists(dest_directory):
@@ -163,161 +158,192 @@ def ensure_dir_exists(dir_name):
         os.makedirs(dir_name)
 
 
-bottleneck_path_2_bottleneck_values = {}
-
-
-def create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                           image_dir, category, sess, jpeg_data_tensor,
-                           decoded_image_tensor, resized_input_tensor,
-                           bottleneck_tensor):
-    """Create a single bottleneck file."""
-    tf.compat.v1.logging.info('Creating bottleneck at ' + bottleneck_path)
-    image_path = get_image_path(image_lists, label_name, index,
-                                image_dir, category)
-    if not tf.compat.v1.gfile.Exists(image_path):
-        tf.compat.v1.logging.fatal('File does not exist %s', image_path)
-    image_data = tf.compat.v1.gfile.GFile(image_path, 'rb').read()
-    try:
-        bottleneck_values = run_bottleneck_on_image(
-            sess, image_data, jpeg_data_tensor, decoded_image_tensor,
-            resized_input_tensor, bottleneck_tensor)
-    except Exception as e:
-        raise RuntimeError('Error during processing file %s (%s)' % (image_path,
-                                                                     str(e)))
-    bottleneck_string = ','.join(str(x) for x in bottleneck_values)
-    with open(bottleneck_path, 'w') as bottleneck_file:
-        bottleneck_file.write(bottleneck_string)
-
-
-def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir,
-                             category, bottleneck_dir, jpeg_data_tensor,
-                             decoded_image_tensor, resized_input_tensor,
-                             bottleneck_tensor, architecture):
-    label_lists = image_lists[label_name]
-    sub_dir = label_lists['dir']
-    sub_dir_path = os.path.join(bottleneck_dir, sub_dir)
-    ensure_dir_exists(sub_dir_path)
+def get_bottleneck_key(image_lists, label_name, index, category):
+    return get_image_path(image_lists, label_name, index, '', category)
+
+
+def move_text_bottleneck(bottleneck_store, image_hash, image_lists,
+                         label_name, index, bottleneck_dir, category,
+                         architecture):
+    """Move a bottleneck cached as comma separated text into the store.
+
+    The text file is deleted once read, so it is only ever imported once.
+    """
     bottleneck_path = get_bottleneck_path(image_lists, label_name, index,
                                           bottleneck_dir, category, architecture)
     if not os.path.exists(bottleneck_path):
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               decoded_image_tensor, resized_input_tensor,
-                               bottleneck_tensor)
-    with open(bottleneck_path, 'r') as bottleneck_file:
-        bottleneck_string = bottleneck_file.read()
-    did_hit_error = False
-    try:
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    except ValueError:
+        return False
+    bottleneck_values = read_text_bottleneck(bottleneck_path)
+    if bottleneck_values is not None:
+        bottleneck_store.put(image_hash, bottleneck_values)
+    else:
         tf.compat.v1.logging.warning(
             'Invalid float found, recreating bottleneck')
-        did_hit_error = True
-    if did_hit_error:
-        create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
-                               image_dir, category, sess, jpeg_data_tensor,
-                               decoded_image_tensor, resized_input_tensor,
-                               bottleneck_tensor)
-        with open(bottleneck_path, 'r') as bottleneck_file:
-            bottleneck_string = bottleneck_file.read()
-        # Allow exceptions to propagate here, since they shouldn't happen after a
-        # fresh creation
-        bottleneck_values = [float(x) for x in bottleneck_string.split(',')]
-    return bottleneck_values
+    os.remove(bottleneck_path)
+    return bottleneck_values is not None
 
 
 def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
                       jpeg_data_tensor, decoded_image_tensor,
-                      resized_input_tensor, bottleneck_tensor, architecture):
-    how_many_bottlenecks = 0
+                      resized_input_tensor, bottleneck_tensor, architecture,
+                      categories=('training', 'testing', 'validation'),
+                      batch_size=1):
     ensure_dir_exists(bottleneck_dir)
+    bottleneck_store = get_bottleneck_store(bottleneck_dir, architecture)
+    jobs = []
+    queued_hashes = set()
     for label_name, label_lists in image_lists.items():
-        for category in ['training', 'testing', 'validation']:
+        for category in categories:
             category_list = label_lists[category]
             for index, unused_base_name in enumerate(category_list):
-                get_or_create_bottleneck(
-                    sess, image_lists, label_name, index, image_dir, category,
-                    bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                    resized_input_tensor, bottleneck_tensor, architecture)
-
-                how_many_bottlenecks += 1
-                if how_many_bottlenecks % 100 == 0:
-                    tf.compat.v1.logging.info(
-                        str(how_many_bottlenecks) + ' bottleneck files created.')
-
-
-def get_random_cached_bottlenecks(sess, image_lists, how_many, category,
-                                  bottleneck_dir, image_dir, jpeg_data_tensor,
-                                  decoded_image_tensor, resized_input_tensor,
-                                  bottleneck_tensor, architecture):
-    class_count = len(image_lists.keys())
-    bottlenecks = []
-    ground_truths = []
-    filenames = []
-    if how_many >= 0:
-        # Retrieve a random sample of bottlenecks.
-        for unused_i in range(how_many):
-            label_index = random.randrange(class_count)
-            label_name = list(image_lists.keys())[label_index]
-            image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
-            image_name = get_image_path(image_lists, label_name, image_index,
-                                        image_dir, category)
-            bottleneck = get_or_create_bottleneck(
-                sess, image_lists, label_name, image_index, image_dir, category,
-                bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                resized_input_tensor, bottleneck_tensor, architecture)
-            ground_truth = np.zeros(class_count, dtype=np.float32)
-            ground_truth[label_index] = 1.0
-            bottlenecks.append(bottleneck)
-            ground_truths.append(ground_truth)
-            filenames.append(image_name)
-    else:
-        # Retrieve all bottlenecks.
-        for label_index, label_name in enumerate(image_lists.keys()):
-            for image_index, image_name in enumerate(
-                    image_lists[label_name][category]):
-                image_name = get_image_path(image_lists, label_name, image_index,
+                bottleneck_key = get_bottleneck_key(image_lists, label_name,
+                                                    index, category)
+                image_path = get_image_path(image_lists, label_name, index,
                                             image_dir, category)
-                bottleneck = get_or_create_bottleneck(
-                    sess, image_lists, label_name, image_index, image_dir, category,
-                    bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-                    resized_input_tensor, bottleneck_tensor, architecture)
-                ground_truth = np.zeros(class_count, dtype=np.float32)
-                ground_truth[label_index] = 1.0
-                bottlenecks.append(bottleneck)
-                ground_truths.append(ground_truth)
-                filenames.append(image_name)
-    return bottlenecks, ground_truths, filenames
-
-
-def get_random_distorted_bottlenecks(
-        sess, image_lists, how_many, category, image_dir, input_jpeg_tensor,
-        distorted_image, resized_input_tensor, bottleneck_tensor):
+                # A legacy text bottleneck can only belong to the image's
+                # content from before the store knew the image; once the
+                # manifest has an entry, it may predate an overwrite.
+                previously_hashed = bottleneck_key in bottleneck_store.files
+                image_hash = bottleneck_store.image_hash(bottleneck_key,
+                                                         image_path)
+                if (image_hash in bottleneck_store or
+                        image_hash in queued_hashes or
+                        (not previously_hashed and
+                         move_text_bottleneck(bottleneck_store, image_hash,
+                                              image_lists, label_name, index,
+                                              bottleneck_dir, category,
+                                              architecture))):
+                    continue
+                queued_hashes.add(image_hash)
+                jobs.append((image_hash, image_path))
+    tf.compat.v1.logging.info('%d new or changed images need bottlenecks',
+                              len(jobs))
+    extract_bottlenecks(sess, jobs, bottleneck_store, jpeg_data_tensor,
+                        decoded_image_tensor, resized_input_tensor,
+                        bottleneck_tensor, batch_size)
+    # Drop bottlenecks of images that were deleted or changed since.
+    dropped = bottleneck_store.collect_garbage(
+        get_bottleneck_key(image_lists, label_name, index, category)
+        for label_name, label_lists in image_lists.items()
+        for category in ['training', 'testing', 'validation']
+        for index in range(len(label_lists[category])))
+    if dropped:
+        tf.compat.v1.logging.info('Removed %d stale bottlenecks', dropped)
+    bottleneck_store.flush()
+
+
+def augmented_store_name(architecture, flip_left_right, random_crop,
+                         random_scale, random_brightness, seed):
+    """Store name of the augmented bottlenecks made with these distortions."""
+    settings = json.dumps([bool(flip_left_right), random_crop, random_scale,
+                           random_brightness, seed])
+    return '%s.augmented-%s' % (
+        architecture, hashlib.sha1(settings.encode('utf-8')).hexdigest()[:10])
+
+
+def cache_augmented_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
+                                distorted_jpeg_data_tensor,
+                                distorted_image_tensor, resized_input_tensor,
+                                bottleneck_tensor, store_name, variants,
+                                batch_size=1):
+    """Bottlenecks of `variants` distorted copies of every training image.
+
+    They go to their own store, named after the distortion settings by
+    `augmented_store_name`, so runs with the same settings reuse them and
+    only add variants or images that are missing.
+    """
+    ensure_dir_exists(bottleneck_dir)
+    augmented_store = get_bottleneck_store(bottleneck_dir, store_name)
+    jobs = []
+    image_keys = []
+    for label_name, label_lists in image_lists.items():
+        for index in range(len(label_lists['training'])):
+            image_key = get_bottleneck_key(image_lists, label_name, index,
+                                           'training')
+            image_path = get_image_path(image_lists, label_name, index,
+                                        image_dir, 'training')
+            image_keys.append(image_key)
+            image_hash = augmented_store.image_hash(image_key, image_path)
+            for variant in range(variants):
+                key = augmented_key(image_hash, variant)
+                if key not in augmented_store:
+                    jobs.append((key, image_path))
+    # Identical copies of an image share their variants.
+    jobs = list(collections.OrderedDict(jobs).items())
+    tf.compat.v1.logging.info('%d augmented bottlenecks to create', len(jobs))
+    # A single decoding thread draws the distortions in job order, so the
+    # seed reproduces the same variants.
+    extract_bottlenecks(sess, jobs, augmented_store, distorted_jpeg_data_tensor,
+                        distorted_image_tensor, resized_input_tensor,
+                        bottleneck_tensor, batch_size, decode_threads=1)
+    dropped = augmented_store.collect_garbage(image_keys)
+    if dropped:
+        tf.compat.v1.logging.info('Removed %d stale augmented bottlenecks',
+                                  dropped)
+    augmented_store.flush()
+    return augmented_store
+
+
+def add_distorted_input_pipeline(image_lists, category, image_dir, batch_size,
+                                 flip_left_right, random_crop, random_scale,
+                                 random_brightness, model_info):
+    """Batches of distorted images of `category` and their ground truth.
+
+    A tf.data pipeline picks a random class and then a random image of it,
+    like the cached batches, and reads and distorts the images on parallel
+    map threads while the previous batch goes through the base network.
+    """
     class_count = len(image_lists.keys())
-    bottlenecks = []
-    ground_truths = []
-    for unused_i in range(how_many):
-        label_index = random.randrange(class_count)
-        label_name = list(image_lists.keys())[label_index]
-        image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
-        image_path = get_image_path(image_lists, label_name, image_index, image_dir,
-                                    category)
-        if not tf.compat.v1.gfile.Exists(image_path):
-            tf.compat.v1.logging.fatal('File does not exist %s', image_path)
-        jpeg_data = tf.compat.v1.gfile.GFile(image_path, 'rb').read()
-        # Note that we materialize the distorted_image_data as a numpy array before
-        # sending running inference on the image. This involves 2 memory copies and
-        # might be optimized in other implementations.
-        distorted_image_data = sess.run(distorted_image,
-                                        {input_jpeg_tensor: jpeg_data})
-        bottleneck_values = sess.run(bottleneck_tensor,
-                                     {resized_input_tensor: distorted_image_data})
-        bottleneck_values = np.squeeze(bottleneck_values)
+    datasets = []
+    for label_index, label_name in enumerate(image_lists.keys()):
+        image_paths = [
+            get_image_path(image_lists, label_name, index, image_dir, category)
+            for index in range(len(image_lists[label_name][category]))]
+        if not image_paths:
+            continue
         ground_truth = np.zeros(class_count, dtype=np.float32)
         ground_truth[label_index] = 1.0
-        bottlenecks.append(bottleneck_values)
-        ground_truths.append(ground_truth)
-    return bottlenecks, ground_truths
+        datasets.append(
+            tf.compat.v1.data.Dataset.from_tensor_slices(image_paths)
+            .shuffle(len(image_paths)).repeat()
+            .map(lambda image_path, ground_truth=ground_truth:
+                 (image_path, ground_truth)))
+    if not datasets:
+        tf.compat.v1.logging.fatal('Category has no images - %s.', category)
+    dataset = tf.compat.v1.data.experimental.sample_from_datasets(datasets)
+
+    def read_and_distort(image_path, ground_truth):
+        return distort_image(
+            tf.compat.v1.read_file(image_path), flip_left_right, random_crop,
+            random_scale, random_brightness, model_info['input_width'],
+            model_info['input_height'], model_info['input_depth'],
+            model_info['input_mean'], model_info['input_std']), ground_truth
+
+    dataset = (dataset
+               .map(read_and_distort,
+                    num_parallel_calls=tf.compat.v1.data.experimental.AUTOTUNE)
+               .batch(batch_size)
+               .prefetch(tf.compat.v1.data.experimental.AUTOTUNE))
+    return tf.compat.v1.data.make_one_shot_iterator(dataset).get_next()
+
+
+def get_distorted_bottlenecks(sess, distorted_batch, resized_input_tensor,
+                              bottleneck_tensor):
+    """Run the next batch of `add_distorted_input_pipeline` through the model.
+
+    The whole batch goes through the base network in one sess.run, or one
+    image at a time if the graph only takes single images.
+    """
+    distorted_images, ground_truth = sess.run(distorted_batch)
+    step = supported_batch_size(resized_input_tensor, bottleneck_tensor,
+                                len(distorted_images))
+    bottlenecks = np.concatenate([
+        np.reshape(sess.run(bottleneck_tensor,
+                            {resized_input_tensor:
+                             distorted_images[begin:begin + step]}),
+                   (-1, int(bottleneck_tensor.shape[-1])))
+        for begin in range(0, len(distorted_images), step)])
+    return bottlenecks, ground_truth
 
 
 def should_distort_images(flip_left_right, random_crop, random_scale,
@@ -326,12 +352,18 @@ def should_distort_images(flip_left_right, random_crop, random_scale,
             (random_brightness != 0))
 
 
-def add_input_distortions(flip_left_right, random_crop, random_scale,
-                          random_brightness, input_width, input_height,
-                          input_depth, input_mean, input_std):
+def distort_image(jpeg_data, flip_left_right, random_crop, random_scale,
+                  random_brightness, input_width, input_height, input_depth,
+                  input_mean, input_std, seed=None):
+    """Decode `jpeg_data` and apply the random distortions to it.
+
+    Returns one [input_height, input_width, input_depth] image, scaled the
+    same way as the images the base network was trained on. With `seed`,
+    the sequence of distortions drawn is the same in every session.
+    """
+    def op_seed(offset):
+        return None if seed is None else seed + offset
 
-    jpeg_data = tf.compat.v1.placeholder(
-        tf.tf.compat.v1, name='DistortJPGInput')
     decoded_image = tf.compat.v1.image.decode_jpeg(
         jpeg_data, channels=input_depth)
     decoded_image_as_float = tf.compat.v1.cast(
@@ -342,7 +374,8 @@ def add_input_distortions(flip_left_right, random_crop, random_scale,
     margin_scale_value = tf.compat.v1.constant(margin_scale)
     resize_scale_value = tf.compat.v1.random_uniform(tf.compat.v1.TensorShape([]),
                                                      minval=1.0,
-                                                     maxval=resize_scale)
+                                                     maxval=resize_scale,
+                                                     seed=op_seed(0))
     scale_value = tf.compat.v1.multiply(margin_scale_value, resize_scale_value)
     precrop_width = tf.compat.v1.multiply(scale_value, input_width)
     precrop_height = tf.compat.v1.multiply(scale_value, input_height)
@@ -353,21 +386,34 @@ def add_input_distortions(flip_left_right, random_crop, random_scale,
     precropped_image_3d = tf.compat.v1.squeeze(
         precropped_image, squeeze_dims=[0])
     cropped_image = tf.compat.v1.random_crop(precropped_image_3d,
-                                             [input_height, input_width, input_depth])
+                                             [input_height, input_width, input_depth],
+                                             seed=op_seed(1))
     if flip_left_right:
         flipped_image = tf.compat.v1.image.random_flip_left_right(
-            cropped_image)
+            cropped_image, seed=op_seed(2))
     else:
         flipped_image = cropped_image
     brightness_min = 1.0 - (random_brightness / 100.0)
     brightness_max = 1.0 + (random_brightness / 100.0)
-    tf.compat.v1.scalar
     brightness_value = tf.compat.v1.random_uniform(tf.compat.v1.TensorShape([]),
                                                    minval=brightness_min,
-                                                   maxval=brightness_max)
+                                                   maxval=brightness_max,
+                                                   seed=op_seed(3))
     brightened_image = tf.compat.v1.multiply(flipped_image, brightness_value)
     offset_image = tf.compat.v1.subtract(brightened_image, input_mean)
-    mul_image = tf.compat.v1.multiply(offset_image, 1.0 / input_std)
+    return tf.compat.v1.multiply(offset_image, 1.0 / input_std)
+
+
+def add_input_distortions(flip_left_right, random_crop, random_scale,
+                          random_brightness, input_width, input_height,
+                          input_depth, input_mean, input_std, seed=None):
+
+    jpeg_data = tf.compat.v1.placeholder(
+        tf.compat.v1.string, name='DistortJPGInput')
+    mul_image = distort_image(jpeg_data, flip_left_right, random_crop,
+                              random_scale, random_brightness, input_width,
+                              input_height, input_depth, input_mean, input_std,
+                              seed)
     distort_result = tf.compat.v1.expand_dims(
         mul_image, 0, name='DistortResult')
     return jpeg_data, distort_result
@@ -387,6 +433,14 @@ def variable_summaries(var):
         tf.compat.v1.summary.histogram('histogram', var)
 
 
+def merge_scalar_summaries():
+    """Merge only the scalar summaries, leaving out the costly histograms."""
+    return tf.compat.v1.summary.merge([
+        summary for summary in tf.compat.v1.get_collection(
+            tf.compat.v1.GraphKeys.SUMMARIES)
+        if summary.op.type == 'ScalarSummary'])
+
+
 def add_final_training_ops(class_count, final_tensor_name, bottleneck_tensor,
                            bottleneck_tensor_size):
     with tf.compat.v1.name_scope('input'):
@@ -627,21 +681,54 @@ def main(_):
             model_info['input_depth'], model_info['input_mean'],
             model_info['input_std'])
 
-        if do_distort_images:
-            # We will be applying distortions, so setup the operations we'll need.
+        distorted_batch = None
+        if do_distort_images and FLAGS.augmented_variants > 0:
+            # We will be training on a bank of distorted variants computed
+            # ahead of time, so setup the operations that make them.
             (distorted_jpeg_data_tensor,
              distorted_image_tensor) = add_input_distortions(
                  FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
                  FLAGS.random_brightness, model_info['input_width'],
                  model_info['input_height'], model_info['input_depth'],
-                 model_info['input_mean'], model_info['input_std'])
+                 model_info['input_mean'], model_info['input_std'],
+                 FLAGS.augmentation_seed)
+            cached_categories = ['testing', 'validation']
+        elif do_distort_images:
+            # We will be applying distortions, so setup the input pipeline that
+            # distorts the training images ahead of the training steps.
+            distorted_batch = add_distorted_input_pipeline(
+                image_lists, 'training', FLAGS.image_dir, FLAGS.train_batch_size,
+                FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
+                FLAGS.random_brightness, model_info)
+            cached_categories = ['testing', 'validation']
         else:
-            # We'll make sure we've calculated the 'bottleneck' image summaries and
-            # cached them on disk.
-            cache_bottlenecks(sess, image_lists, FLAGS.image_dir,
-                              FLAGS.bottleneck_dir, jpeg_data_tensor,
-                              decoded_image_tensor, resized_image_tensor,
-                              bottleneck_tensor, FLAGS.architecture)
+            cached_categories = ['training', 'testing', 'validation']
+        # We'll make sure we've calculated the 'bottleneck' image summaries and
+        # cached them on disk, then keep them in memory for sampling batches.
+        cache_bottlenecks(sess, image_lists, FLAGS.image_dir,
+                          FLAGS.bottleneck_dir, jpeg_data_tensor,
+                          decoded_image_tensor, resized_image_tensor,
+                          bottleneck_tensor, FLAGS.architecture, cached_categories,
+                          FLAGS.bottleneck_batch_size)
+        bottleneck_store = get_bottleneck_store(FLAGS.bottleneck_dir,
+                                                FLAGS.architecture)
+        cached_bottlenecks = dict(
+            (category, CachedBottlenecks(bottleneck_store, image_lists,
+                                         category, FLAGS.image_dir))
+            for category in cached_categories)
+        if do_distort_images and FLAGS.augmented_variants > 0:
+            augmented_store = cache_augmented_bottlenecks(
+                sess, image_lists, FLAGS.image_dir, FLAGS.bottleneck_dir,
+                distorted_jpeg_data_tensor, distorted_image_tensor,
+                resized_image_tensor, bottleneck_tensor,
+                augmented_store_name(FLAGS.architecture, FLAGS.flip_left_right,
+                                     FLAGS.random_crop, FLAGS.random_scale,
+                                     FLAGS.random_brightness,
+                                     FLAGS.augmentation_seed),
+                FLAGS.augmented_variants, FLAGS.bottleneck_batch_size)
+            cached_bottlenecks['training'] = CachedBottlenecks(
+                augmented_store, image_lists, 'training', FLAGS.image_dir,
+                variants=FLAGS.augmented_variants)
 
         # Add the new layer that we'll be training.
         (train_step, cross_entropy, bottleneck_input, ground_truth_input,
@@ -655,6 +742,7 @@ def main(_):
 
         # Merge all the summaries and write them out to the summaries_dir
         merged = tf.compat.v1.summary.merge_all()
+        scalar_summaries = merge_scalar_summaries()
         train_writer = tf.compat.v1.summary.FileWriter("{}/{}".format(FLAGS.summaries_dir, FLAGS.architecture) +
                                                        '/train', sess.graph)
 
@@ -666,33 +754,44 @@ def main(_):
         sess.run(init)
 
         # Run the training for as many cycles as requested on the command line.
+        interval_start = time.time()
+        interval_first_step = 0
         for i in range(FLAGS.how_many_training_steps):
             # Get a batch of input bottleneck values, either calculated fresh every
             # time with distortions applied, or from the cache stored on disk.
-            if do_distort_images:
+            if distorted_batch is not None:
                 (train_bottlenecks,
-                 train_ground_truth) = get_random_distorted_bottlenecks(
-                     sess, image_lists, FLAGS.train_batch_size, 'training',
-                     FLAGS.image_dir, distorted_jpeg_data_tensor,
-                     distorted_image_tensor, resized_image_tensor, bottleneck_tensor)
+                 train_ground_truth) = get_distorted_bottlenecks(
+                     sess, distorted_batch, resized_image_tensor,
+                     bottleneck_tensor)
             else:
                 (train_bottlenecks,
-                 train_ground_truth, _) = get_random_cached_bottlenecks(
-                     sess, image_lists, FLAGS.train_batch_size, 'training',
-                     FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                     decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                     FLAGS.architecture)
+                 train_ground_truth, _) = cached_bottlenecks['training'].sample(
+                     FLAGS.train_batch_size)
             # Feed the bottlenecks and ground truth into the graph, and run a training
-            # step. Capture training summaries for TensorBoard with the `merged` op.
-            train_summary, _ = sess.run(
-                [merged, train_step],
-                feed_dict={bottleneck_input: train_bottlenecks,
-                           ground_truth_input: train_ground_truth})
-            train_writer.add_summary(train_summary, i)
+            # step. Capture training summaries for TensorBoard with the `merged` op
+            # on evaluation steps, and only the scalars every --summary_interval.
+            is_last_step = (i + 1 == FLAGS.how_many_training_steps)
+            is_eval_step = (i % FLAGS.eval_step_interval) == 0 or is_last_step
+            train_feed_dict = {bottleneck_input: train_bottlenecks,
+                               ground_truth_input: train_ground_truth}
+            if is_eval_step:
+                train_summary, _ = sess.run([merged, train_step],
+                                            feed_dict=train_feed_dict)
+                train_writer.add_summary(train_summary, i)
+            elif FLAGS.summary_interval > 0 and i % FLAGS.summary_interval == 0:
+                train_summary, _ = sess.run([scalar_summaries, train_step],
+                                            feed_dict=train_feed_dict)
+                train_writer.add_summary(train_summary, i)
+            else:
+                sess.run(train_step, feed_dict=train_feed_dict)
 
             # Every so often, print out how well the graph is training.
-            is_last_step = (i + 1 == FLAGS.how_many_training_steps)
-            if (i % FLAGS.eval_step_interval) == 0 or is_last_step:
+            if is_eval_step:
+                tf.compat.v1.logging.info('%s: Step %d: %.1f steps/sec' %
+                                          (datetime.now(), i,
+                                           (i + 1 - interval_first_step) /
+                                           (time.time() - interval_start)))
                 train_accuracy, cross_entropy_value = sess.run(
                     [evaluation_step, cross_entropy],
                     feed_dict={bottleneck_input: train_bottlenecks,
@@ -702,11 +801,8 @@ def main(_):
                 tf.compat.v1.logging.info('%s: Step %d: Cross entropy = %f' %
                                           (datetime.now(), i, cross_entropy_value))
                 validation_bottlenecks, validation_ground_truth, _ = (
-                    get_random_cached_bottlenecks(
-                        sess, image_lists, FLAGS.validation_batch_size, 'validation',
-                        FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                        decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                        FLAGS.architecture))
+                    cached_bottlenecks['validation'].sample(
+                        FLAGS.validation_batch_size))
                 # Run a validation step and capture training summaries for TensorBoard
                 # with the `merged` op.
                 validation_summary, validation_accuracy = sess.run(
@@ -717,6 +813,8 @@ def main(_):
                 tf.compat.v1.logging.info('%s: Step %d: Validation accuracy = %.1f%% (N=%d)' %
                                           (datetime.now(), i, validation_accuracy * 100,
                                            len(validation_bottlenecks)))
+                interval_start = time.time()
+                interval_first_step = i + 1
 
             # Store intermediate results
             intermediate_frequency = FLAGS.intermediate_store_frequency
@@ -732,11 +830,8 @@ def main(_):
         # We've completed all our training, so run a final test evaluation on
         # some new images we haven't used before.
         test_bottlenecks, test_ground_truth, test_filenames = (
-            get_random_cached_bottlenecks(
-                sess, image_lists, FLAGS.test_batch_size, 'testing',
-                FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                FLAGS.architecture))
+            cached_bottlenecks['testing'].sample(
+                FLAGS.test_batch_size))
         test_accuracy, predictions = sess.run(
             [evaluation_step, prediction],
             feed_dict={bottleneck_input: test_bottlenecks,
@@ -830,6 +925,16 @@ if __name__ == '__main__':
         default=10,
         help='How often to evaluate the training results.'
     )
+    parser.add_argument(
+        '--summary_interval',
+        type=int,
+        default=0,
+        help="""\
+        How often to write the scalar training summaries between evaluations.
+        Histograms are only computed with an evaluation, every
+        --eval_step_interval steps. If "0", steps in between only train.\
+        """
+    )
     parser.add_argument(
         '--train_batch_size',
         type=int,
@@ -884,6 +989,15 @@ if __name__ == '__main__':
         default='tf/tf_files/bottlenecks',
         help='Path to cache bottleneck layer values as files.'
     )
+    parser.add_argument(
+        '--bottleneck_batch_size',
+        type=int,
+        default=32,
+        help="""\
+      How many images to run through the base network at once while caching
+      bottlenecks. Graphs built for a single image fall back to 1.\
+      """
+    )
     parser.add_argument(
         '--final_tensor_name',
         type=str,
@@ -927,6 +1041,23 @@ if __name__ == '__main__':
       input pixels up or down by.\
       """
     )
+    parser.add_argument(
+        '--augmented_variants',
+        type=int,
+        default=0,
+        help="""\
+      With distortions, compute the bottlenecks of this many distorted variants
+      of every training image once, and train on those at cached speed. They
+      are kept with the bottlenecks and reused by runs with the same
+      distortion settings and seed. If "0", images are distorted on the fly.\
+      """
+    )
+    parser.add_argument(
+        '--augmentation_seed',
+        type=int,
+        default=0,
+        help='Seed of the distortions drawn for --augmented_variants.'
+    )
     parser.add_argument(
         '--architecture',
         type=str,
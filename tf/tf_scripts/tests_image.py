@@ -8,15 +8,17 @@ import time
 import os
 import re
 
-import numpy as np
 import tensorflow as tf
 from tensorflow.python.platform import gfile
 import collections
 
+from tf.tf_scripts.evaluation import EvaluationEngine
+from tf.tf_scripts.preprocess import ImagePreprocessor
+
 
 def create_image_lists(image_dir):
     if not tf.compat.v1.gfile.Exists(image_dir):
-        tf.logging.error("Image directory '" + image_dir + "' not found.")
+        tf.compat.v1.logging.error("Image directory '" + image_dir + "' not found.")
         return None
     result = collections.OrderedDict()
     sub_dirs = [
@@ -30,12 +32,12 @@ def create_image_lists(image_dir):
         dir_name = os.path.basename(sub_dir)
         if dir_name == image_dir:
             continue
-        tf.logging.info("Looking for images in '" + dir_name + "'")
+        tf.compat.v1.logging.info("Looking for images in '" + dir_name + "'")
         for extension in extensions:
             file_glob = os.path.join(image_dir, dir_name, '*.' + extension)
             file_list.extend(gfile.Glob(file_glob))
         if not file_list:
-            tf.logging.warning('No files found')
+            tf.compat.v1.logging.warning('No files found')
             continue
         label_name = re.sub(r'[^a-z0-9]+', ' ', dir_name.lower())
         result[label_name] = {
@@ -47,42 +49,16 @@ def create_image_lists(image_dir):
 
 def load_graph(model_file):
     graph = tf.Graph()
-    graph_def = tf.GraphDef()
+    graph_def = tf.compat.v1.GraphDef()
 
     with open(model_file, "rb") as f:
         graph_def.ParseFromString(f.read())
     with graph.as_default():
-        tf.import_graph_def(graph_def)
+        tf.compat.v1.import_graph_def(graph_def)
 
     return graph
 
 
-def read_tensor_from_image_file(file_name, input_height=299, input_width=299, input_mean=0, input_std=255):
-    input_name = "file_reader"
-    # output_name = "normalized"
-    file_reader = tf.read_file(file_name, input_name)
-    if file_name.endswith(".png"):
-        image_reader = tf.image.decode_png(file_reader, channels=3,
-                                           name='png_reader')
-    elif file_name.endswith(".gif"):
-        image_reader = tf.squeeze(tf.image.decode_gif(file_reader,
-                                                      name='gif_reader'))
-    elif file_name.endswith(".bmp"):
-        image_reader = tf.image.decode_bmp(file_reader, name='bmp_reader')
-    else:
-        image_reader = tf.image.decode_jpeg(file_reader, channels=3,
-                                            name='jpeg_reader')
-    float_caster = tf.cast(image_reader, tf.float32)
-    dims_expander = tf.expand_dims(float_caster, 0)
-    resized = tf.image.resize_bilinear(
-        dims_expander, [input_height, input_width])
-    normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
-    sess = tf.Session()
-    result = sess.run(normalized)
-
-    return result
-
-
 def load_labels(label_file):
     label = []
     proto_as_ascii_lines = tf.compat.v1.gfile.GFile(label_file).readlines()
@@ -162,6 +138,18 @@ if __name__ == "__main__":
         default="final_result",
         help="name of output layer"
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="images run through the graph at once"
+    )
+    parser.add_argument(
+        "--preprocess_threads",
+        type=int,
+        default=0,
+        help="threads decoding images ahead of inference, 0 for one per core"
+    )
     args = parser.parse_args()
 
     if args.graph:
@@ -188,37 +176,21 @@ if __name__ == "__main__":
 
     input_name = "import/" + input_layer
     output_name = "import/" + output_layer
-    input_operation = graph.get_operation_by_name(input_name)
-    output_operation = graph.get_operation_by_name(output_name)
-
-    sumary = {}
-    start = time.time()
-    for label_name, label_lists in label_results.items():
-        sumary[label_name] = {
-            "list_score": []
-        }
-        sum_score = 0
-        for index, img in enumerate(label_lists["test"]):
-            t = read_tensor_from_image_file(img,
-                                            input_height=input_height,
-                                            input_width=input_width,
-                                            input_mean=input_mean,
-                                            input_std=input_std)
-            with tf.Session(graph=graph) as sess:
-                results = sess.run(output_operation.outputs[0], {
-                                   input_operation.outputs[0]: t})
-            results = np.squeeze(results)
-            labels = load_labels(label_file)
-            labels_idx = dict([(value, idx)
-                               for idx, value in enumerate(labels)])
-            score = results[labels_idx[label_name]]
-            sum_score += score
-            sumary[label_name]["list_score"].append(score)
-        sumary[label_name]["average"] = sum_score / \
-            len(sumary[label_name]["list_score"])
-    end = time.time()
+
+    preprocessor = ImagePreprocessor(input_height=input_height,
+                                     input_width=input_width,
+                                     input_mean=input_mean,
+                                     input_std=input_std)
+
+    with EvaluationEngine(graph, input_name, output_name,
+                          load_labels(label_file), args.batch_size,
+                          args.preprocess_threads) as engine:
+        start = time.time()
+        sumary, images_per_sec = engine.evaluate(label_results, preprocessor)
+        end = time.time()
+    preprocessor.close()
     print(" >>> Test accuracy images <<<")
-    print("use time {}".format(end - start))
+    print("use time {} ({:.1f} images/sec)".format(end - start, images_per_sec))
     for leaf, leaf_scores in sumary.items():
         print("{} amount {} leafs ~ ~ ~ average of test accuracy: {:.2f}%".format(
             leaf, len(leaf_scores["list_score"]), leaf_scores["average"]*100))